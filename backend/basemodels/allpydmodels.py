@@ -1,6 +1,22 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, BeforeValidator, Field
+from typing import Annotated, List, Optional, Union
 from datetime import datetime
+import re
+
+#gemini writes scores as "85", "85%" or "8/10", keep the leading number
+def parse_score(value):
+    if isinstance(value, str):
+        match = re.search(r"-?\d+(\.\d+)?", value)
+        if match:
+            return float(match.group())
+    return value
+
+def parse_int_score(value):
+    value = parse_score(value)
+    return round(value) if isinstance(value, float) else value
+
+Score = Annotated[float, BeforeValidator(parse_score)]
+IntScore = Annotated[int, BeforeValidator(parse_int_score)]
 
 class UserLogin(BaseModel):
     username: str
@@ -18,6 +34,12 @@ class InfoDict(BaseModel):
     language: str
     username: str
 
+class LeaderboardQuery(BaseModel):
+    language: str
+    username: str
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+
 class ScoreDict(BaseModel):
     language: str
     username: str
@@ -32,7 +54,7 @@ class StoryNarrate(BaseModel):
     username: str
 
 class NarrationFeedback(BaseModel):
-    accuracy_score: float
+    accuracy_score: Score
     pronunciation_feedback: str
     grammar_feedback: str
     vocabulary_feedback: str
@@ -44,7 +66,7 @@ class StoryPart(BaseModel):
     content: str
     translation: str
     description: str
-    user_narration: Optional[dict]
+    user_narration: Optional[dict] = None
 
 class ActiveStory(BaseModel):
     user_id: str
@@ -67,4 +89,62 @@ class TongueTwister(BaseModel):
 class AnalyzeSpeech(BaseModel):
     language: str
     transcription: str
-    username: str
\ No newline at end of file
+    username: str
+    reference: Optional[str] = None
+
+#structured llm outputs, validated by utils/llm_output
+class Flashcard(BaseModel):
+    new_concept: str
+    concept_pronunciation: str
+    english: str
+    meaning: str
+    example: str
+    example_pronunciation: str
+    translation: str
+
+class DailiesSet(BaseModel):
+    cards: List[Flashcard]
+
+class MemoryPairsSet(BaseModel):
+    pairs: List[List[str]]
+
+#every level of a language in one answer, see generate_language_content
+class LevelContent(BaseModel):
+    dailies: DailiesSet
+    memory_pairs: MemoryPairsSet
+
+class LanguageContent(BaseModel):
+    beginner: LevelContent
+    intermediate: LevelContent
+    advanced: LevelContent
+
+class TeacherResponse(BaseModel):
+    response: str
+    examples: Union[str, List[str]]
+    interesting_facts: Union[str, List[str]]
+
+class TongueTwisterItem(BaseModel):
+    text: str
+    pronunciation: str
+    translation: str
+
+class TongueTwisterSet(BaseModel):
+    tongue_twisters: List[TongueTwisterItem]
+
+class SpeechAnalysisResult(BaseModel):
+    original: str
+    correct_form: str
+    alternatives: List[str]
+    score: IntScore
+
+class GeneratedStory(BaseModel):
+    title: str
+    title_english: str
+    #narration walks exactly five parts, a shorter or longer answer goes to the repair step
+    parts: List[StoryPart] = Field(min_length=5, max_length=5)
+
+class FinalFeedback(BaseModel):
+    overall_score: Score
+    key_strengths: List[str]
+    main_improvement_areas: List[str]
+    learning_recommendations: List[str]
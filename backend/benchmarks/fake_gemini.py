@@ -0,0 +1,168 @@
+import asyncio
+import json
+import random
+from collections import Counter
+
+#deterministic stand-in for genai.GenerativeModel, answers every prompt the app sends with canned json
+try:
+    from google.api_core.exceptions import ServiceUnavailable as FakeOutage
+except ImportError:
+    FakeOutage = asyncio.TimeoutError
+
+
+def _words(rng: random.Random, count: int) -> str:
+    vocabulary = ["sol", "casa", "perro", "libro", "agua", "tren", "mar", "luna", "pan", "flor", "cielo", "gato"]
+    return " ".join(rng.choice(vocabulary) for _ in range(count))
+
+
+def _story(rng: random.Random, serial: int) -> dict:
+    return {
+        "title": f"La historia {serial}",
+        "title_english": f"Story {serial}",
+        "parts": [
+            {
+                "part_number": number,
+                "content": f"{_words(rng, 8)}. {_words(rng, 6)}.",
+                "translation": "english translation",
+                "description": "a pixel art scene",
+            }
+            for number in range(1, 6)
+        ],
+    }
+
+
+def _flashcards(rng: random.Random) -> dict:
+    return {"cards": [
+        {
+            "new_concept": _words(rng, 1),
+            "concept_pronunciation": "pro-nun-ci-a-tion",
+            "english": "word",
+            "meaning": "meaning",
+            "example": _words(rng, 5),
+            "example_pronunciation": "pro-nun-ci-a-tion",
+            "translation": "translation",
+        }
+        for _ in range(10)
+    ]}
+
+
+def _narration_feedback(rng: random.Random) -> dict:
+    return {
+        "accuracy_score": str(rng.randint(40, 90)),
+        "pronunciation_feedback": "Mostly clear.",
+        "grammar_feedback": "Watch the verb endings.",
+        "vocabulary_feedback": "Good word choice.",
+        "improvement_areas": ["pace", "endings", "stress"],
+        "positive_points": ["fluency", "confidence", "order"],
+    }
+
+
+def _final_feedback(rng: random.Random) -> dict:
+    return {
+        "overall_score": f"{rng.randint(50, 95)}%",
+        "key_strengths": ["fluency", "vocabulary"],
+        "main_improvement_areas": ["pronunciation", "grammar"],
+        "learning_recommendations": ["read aloud daily", "shadow native audio"],
+    }
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeStream:
+    def __init__(self, text: str, chunk_size: int, chunk_latency: float):
+        self.text = text
+        self.chunk_size = chunk_size
+        self.chunk_latency = chunk_latency
+
+    async def __aiter__(self):
+        for start in range(0, len(self.text), self.chunk_size):
+            await asyncio.sleep(self.chunk_latency)
+            yield FakeResponse(self.text[start:start + self.chunk_size])
+
+
+class FakeGenerativeModel:
+    #prompt kinds are recognised by the wording of the helpers in utils/all_helper and utils/story_helper
+    KINDS = [
+        #checked first, the batched prompt also mentions flashcards and the memory game
+        ("content for each of these levels", "language_content"),
+        ("5-part story", "story"),
+        ("flashcards", "dailies"),
+        ("memory matching game", "memory_pairs"),
+        ("language teaching assistant", "teacher"),
+        ("tongue twisters", "tongue_twisters"),
+        ("speech transcript", "speech_analysis"),
+        ("Compare the following original text", "narration_feedback"),
+        ("Analyze overall language learning performance", "final_feedback"),
+    ]
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.3, error_rate: float = 0.0,
+                 chunk_size: int = 64, chunk_latency: float = 0.02, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.chunk_latency = chunk_latency
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.errors = 0
+        self._stories = 0
+
+    def _kind(self, prompt: str) -> str:
+        for marker, kind in self.KINDS:
+            if marker in prompt:
+                return kind
+        return "unknown"
+
+    def _answer(self, kind: str) -> dict:
+        rng = self.rng
+        if kind == "story":
+            self._stories += 1
+            return _story(rng, self._stories)
+        if kind == "language_content":
+            return {
+                level: {"dailies": _flashcards(rng), "memory_pairs": {"pairs": [[_words(rng, 1), "word"] for _ in range(10)]}}
+                for level in ("beginner", "intermediate", "advanced")
+            }
+        if kind == "dailies":
+            return _flashcards(rng)
+        if kind == "memory_pairs":
+            return {"pairs": [[_words(rng, 1), "word"] for _ in range(10)]}
+        if kind == "teacher":
+            return {"response": _words(rng, 12), "examples": [_words(rng, 4)], "interesting_facts": _words(rng, 6)}
+        if kind == "tongue_twisters":
+            return {"tongue_twisters": [
+                {"text": _words(rng, 6), "pronunciation": "pro-nun-ci-a-tion", "translation": "translation"}
+                for _ in range(5)
+            ]}
+        if kind == "speech_analysis":
+            return {"original": _words(rng, 5), "correct_form": _words(rng, 5), "alternatives": [_words(rng, 5)], "score": "7/10"}
+        if kind == "narration_feedback":
+            return _narration_feedback(rng)
+        if kind == "final_feedback":
+            return _final_feedback(rng)
+        return {}
+
+    async def generate_content_async(self, prompt: str, stream: bool = False):
+        kind = self._kind(prompt)
+        self.calls[kind] += 1
+        #time to first token, the stream then adds its per chunk latency
+        await asyncio.sleep(max(0.0, self.rng.gauss(self.latency, self.jitter)))
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            raise FakeOutage("fake gemini outage")
+        text = "```json\n" + json.dumps(self._answer(kind), ensure_ascii=False) + "\n```"
+        if stream:
+            return FakeStream(text, self.chunk_size, self.chunk_latency)
+        return FakeResponse(text)
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "total_calls": sum(self.calls.values()), "errors": self.errors}
+
+
+def install(model: FakeGenerativeModel):
+    #every helper goes through utils.llm_client, swapping its model swaps gemini for the whole app
+    from utils.llm_client import set_model
+    set_model(model)
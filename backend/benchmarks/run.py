@@ -0,0 +1,183 @@
+"""Offline benchmark for the LangStar backend.
+
+Runs the app in-process against a fake Gemini and an in-memory Mongo (or a local mongod),
+replays learner sessions at a given concurrency and reports per-endpoint latency percentiles.
+
+    cd backend
+    pip install -r requirements.txt -r benchmarks/requirements.txt
+    python -m benchmarks.run --sessions 200 --concurrency 50
+    python -m benchmarks.run --json baseline.json
+    python -m benchmarks.run --baseline baseline.json --tolerance 0.2
+
+With --baseline the run exits non-zero when an endpoint's p95 or the overall req/s regressed
+by more than the tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay learner sessions against the backend with a fake Gemini")
+    parser.add_argument("--sessions", type=int, default=100, help="learner sessions to replay")
+    parser.add_argument("--concurrency", type=int, default=20, help="sessions running at once")
+    parser.add_argument("--memory-rounds", type=int, default=2, help="memory pair games per session")
+    parser.add_argument("--score-burst", type=int, default=6, help="max updatescore calls after each game")
+    parser.add_argument("--exact-ratio", type=float, default=0.3, help="share of narrations read back exactly")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="mean fake gemini latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.3, help="stddev of the fake gemini latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of fake gemini calls that fail")
+    parser.add_argument("--mongo-uri", help="local mongod to run against, the in-memory stand-in when omitted")
+    parser.add_argument("--bcrypt-rounds", type=int, help="override BCRYPT_ROUNDS for the run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against the baseline")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    #settings are read at import time, so they are set before the app is imported
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    scratch = tempfile.mkdtemp(prefix="langstar-bench-")
+    os.environ["SCORE_JOURNAL_DIR"] = scratch
+    #a fresh host cache per run, otherwise a second run starts warm
+    os.environ["HOST_CACHE_PATH"] = os.path.join(scratch, "host-cache.sqlite3")
+    os.environ["DAILIES_PREFETCH"] = "false"
+    if args.bcrypt_rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    else:
+        #the in-memory stand-in has no $setWindowFields, leaderboards are served live
+        os.environ["LEADERBOARD_SNAPSHOT_INTERVAL"] = "0"
+
+
+def use_in_memory_mongo(mongo):
+    from mongomock_motor import AsyncMongoMockClient
+
+    def connect():
+        mongo.client = AsyncMongoMockClient()
+
+    mongo.connect = connect
+
+
+def percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(recorder, elapsed: float) -> dict:
+    endpoints = {}
+    for name, samples in sorted(recorder.latencies.items()):
+        ordered = sorted(samples)
+        endpoints[name] = {
+            "count": len(ordered),
+            "errors": recorder.errors[name],
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 1),
+            "req_per_s": round(len(ordered) / elapsed, 2),
+        }
+    total = sum(endpoint["count"] for endpoint in endpoints.values())
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "req_per_s": round(total / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+
+def print_report(results: dict, llm_stats: dict):
+    print(f"{'endpoint':<20}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}")
+    for name, row in results["endpoints"].items():
+        print(f"{name:<20}{row['count']:>8}{row['errors']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}{row['req_per_s']:>9}")
+    print(f"\n{results['requests']} requests in {results['elapsed_s']}s, {results['req_per_s']} req/s")
+    print(f"gemini: {llm_stats['total_calls']} calls, {llm_stats['errors']} failed, {llm_stats['calls']}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, row in results["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before and before["p95_ms"] and row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {row['p95_ms']}ms")
+    if results["req_per_s"] < baseline["req_per_s"] * (1 - tolerance):
+        regressions.append(f"throughput: {baseline['req_per_s']} -> {results['req_per_s']} req/s")
+    return regressions
+
+
+async def replay(args, app) -> dict:
+    import httpx
+    from benchmarks.sessions import Recorder, run_session
+
+    recorder = Recorder()
+    run_id = uuid.uuid4().hex[:8]
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def one(index: int, client):
+        async with slots:
+            rng = random.Random(args.seed * 100003 + index)
+            await run_session(client, recorder, rng, f"bench-{run_id}-{index}", args)
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(one(index, client) for index in range(args.sessions)))
+            elapsed = time.perf_counter() - started
+    return summarize(recorder, elapsed)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment(args)
+
+    from benchmarks.fake_gemini import FakeGenerativeModel, install
+    from database import mongo
+    from main import app
+    from utils.score_buffer import score_buffer
+
+    model = FakeGenerativeModel(
+        latency=args.llm_latency,
+        jitter=args.llm_jitter,
+        error_rate=args.llm_error_rate,
+        seed=args.seed,
+    )
+    install(model)
+    if not args.mongo_uri:
+        use_in_memory_mongo(mongo)
+
+    results = asyncio.run(replay(args, app))
+    results["gemini"] = model.stats()
+    print_report(results, results["gemini"])
+    if score_buffer.flush_errors:
+        #score writes never reached mongo, so the leaderboard and score numbers measure nothing
+        print(f"\nscore buffer failed to flush {score_buffer.flush_errors} times, check the pymongo / mongomock-motor versions")
+        sys.exit(1)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nregressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import random
+import time
+from collections import defaultdict
+
+#one learner's visit as the frontend makes it:
+#register -> login -> dailies -> memorypairs with updatescore bursts -> storystart -> 5x storynarrate -> leaderboard
+LANGUAGES = ["SPANISH", "FRENCH", "GERMAN", "ITALIAN", "GUJARATI", "TELUGU", "JAPANESE"]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client, method: str, path: str, name: str = None, **kwargs):
+        name = name or path
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except Exception:
+            self.latencies[name].append(time.perf_counter() - started)
+            self.errors[name] += 1
+            return None
+        self.latencies[name].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[name] += 1
+            return None
+        return response.json()
+
+
+def narrate(rng: random.Random, content: str, exact_ratio: float) -> str:
+    #exact reads are scored locally, reads with dropped words go to gemini
+    if rng.random() < exact_ratio:
+        return content
+    words = content.split()
+    kept = [word for word in words if rng.random() > 0.4]
+    return " ".join(kept or words[:1])
+
+
+async def run_session(client, recorder: Recorder, rng: random.Random, username: str, options) -> None:
+    language = rng.choice(LANGUAGES)
+    credentials = {"username": username, "password": "benchmark-password"}
+    body = {"username": username, "language": language}
+
+    if await recorder.call(client, "POST", "/register", json=credentials) is None:
+        return
+    await recorder.call(client, "POST", "/login", json=credentials)
+    await recorder.call(client, "POST", "/dailies", json=body)
+
+    for _ in range(options.memory_rounds):
+        await recorder.call(client, "POST", "/memorypairs", json=body)
+        for _ in range(rng.randint(1, options.score_burst)):
+            await recorder.call(client, "POST", "/updatescore", json={**body, "score": rng.randint(1, 10)})
+
+    story = await recorder.call(client, "POST", "/storystart", json=body)
+    part = story and story.get("current_part")
+    for _ in range(5):
+        if not part:
+            break
+        result = await recorder.call(client, "POST", "/storynarrate", json={
+            "username": username,
+            "transcription": narrate(rng, part["content"], options.exact_ratio),
+        })
+        part = result and result.get("next_part")
+
+    await recorder.call(client, "POST", "/leaderboard", json=body)
@@ -0,0 +1,128 @@
+import os
+import tempfile
+from dataclasses import dataclass, field, fields
+import dotenv
+
+#every setting the backend reads, parsed from the environment (and .env) once at import
+REQUIRED = object()
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def setting(env: str, default=REQUIRED):
+    return field(default=default, metadata={"env": env})
+
+
+@dataclass(frozen=True)
+class Settings:
+    #auth
+    secret_key: str = setting('SECRET_KEY')
+    algorithm: str = setting('ALGORITHM')
+    access_token_expire_minutes: int = setting('ACCESS_TOKEN_EXPIRE_MINUTES')
+    bcrypt_rounds: int = setting('BCRYPT_ROUNDS', 12)
+    password_workers: int = setting('PASSWORD_WORKERS', min(4, os.cpu_count() or 1))
+    password_max_queue: int = setting('PASSWORD_MAX_QUEUE', 32)
+
+    #mongo
+    mongo_uri: str = setting('MONGO_URI', None)
+    mongo_max_pool_size: int = setting('MONGO_MAX_POOL_SIZE', 100)
+    mongo_min_pool_size: int = setting('MONGO_MIN_POOL_SIZE', 0)
+    mongo_connect_timeout_ms: int = setting('MONGO_CONNECT_TIMEOUT_MS', 5000)
+    mongo_server_selection_timeout_ms: int = setting('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)
+    mongo_socket_timeout_ms: int = setting('MONGO_SOCKET_TIMEOUT_MS', 20000)
+
+    #gemini
+    google_api_key: str = setting('GOOGLE_API_KEY', None)
+    llm_model: str = setting('LLM_MODEL', 'gemini-pro')
+    llm_max_concurrency: int = setting('LLM_MAX_CONCURRENCY', 64)
+    llm_tokens_per_minute: int = setting('LLM_TOKENS_PER_MINUTE', 1000000)
+    llm_max_queue: int = setting('LLM_MAX_QUEUE', 256)
+    llm_expected_output_tokens: int = setting('LLM_EXPECTED_OUTPUT_TOKENS', 800)
+    llm_queue_deadline_interactive: float = setting('LLM_QUEUE_DEADLINE_INTERACTIVE', 20.0)
+    llm_queue_deadline_batch: float = setting('LLM_QUEUE_DEADLINE_BATCH', 60.0)
+    llm_queue_deadline_prefetch: float = setting('LLM_QUEUE_DEADLINE_PREFETCH', 300.0)
+    llm_call_timeout: float = setting('LLM_CALL_TIMEOUT', 30.0)
+    llm_retries: int = setting('LLM_RETRIES', 2)
+    llm_retry_base_delay: float = setting('LLM_RETRY_BASE_DELAY', 0.5)
+    llm_hedge: bool = setting('LLM_HEDGE', False)
+    llm_hedge_min_samples: int = setting('LLM_HEDGE_MIN_SAMPLES', 50)
+    llm_breaker_failures: int = setting('LLM_BREAKER_FAILURES', 5)
+    llm_breaker_reset: float = setting('LLM_BREAKER_RESET', 30.0)
+    llm_repair_attempts: int = setting('LLM_REPAIR_ATTEMPTS', 1)
+
+    #caches and pools
+    content_pool_target_size: int = setting('CONTENT_POOL_TARGET_SIZE', 5)
+    content_pool_low_water: int = setting('CONTENT_POOL_LOW_WATER', 2)
+    content_pool_max_uses: int = setting('CONTENT_POOL_MAX_USES', 20)
+    content_pool_warm: bool = setting('CONTENT_POOL_WARM', False)
+    cache_local_size: int = setting('CACHE_LOCAL_SIZE', 1024)
+    cache_local_ttl: int = setting('CACHE_LOCAL_TTL', 3600)
+    cache_shared_ttl: int = setting('CACHE_SHARED_TTL', 7 * 24 * 3600)
+    dailies_timezone: str = setting('DAILIES_TIMEZONE', 'UTC')
+    dailies_retention_days: int = setting('DAILIES_RETENTION_DAYS', 2)
+    dailies_prefetch: bool = setting('DAILIES_PREFETCH', True)
+    dailies_prefetch_hours: str = setting('DAILIES_PREFETCH_HOURS', '1-5')
+    dailies_active_days: int = setting('DAILIES_ACTIVE_DAYS', 3)
+    story_library_low_water: int = setting('STORY_LIBRARY_LOW_WATER', 3)
+    story_library_batch: int = setting('STORY_LIBRARY_BATCH', 5)
+    story_library_max_size: int = setting('STORY_LIBRARY_MAX_SIZE', 500)
+    story_session_cache_size: int = setting('STORY_SESSION_CACHE_SIZE', 10000)
+
+    #background work
+    leaderboard_page_size: int = setting('LEADERBOARD_PAGE_SIZE', 100)
+    leaderboard_snapshot_interval: int = setting('LEADERBOARD_SNAPSHOT_INTERVAL', 60)
+    feedback_job_stale_seconds: int = setting('FEEDBACK_JOB_STALE_SECONDS', 300)
+    score_flush_interval: float = setting('SCORE_FLUSH_INTERVAL', 1.0)
+    score_flush_threshold: int = setting('SCORE_FLUSH_THRESHOLD', 500)
+    score_journal_dir: str = setting('SCORE_JOURNAL_DIR', os.path.join(tempfile.gettempdir(), 'langstar-scores'))
+
+    #scoring
+    narration_local_high: float = setting('NARRATION_LOCAL_HIGH', 95.0)
+    narration_local_low: float = setting('NARRATION_LOCAL_LOW', 30.0)
+
+    #serving
+    web_concurrency: int = setting('WEB_CONCURRENCY', 0)
+    bind: str = setting('BIND', '0.0.0.0:8000')
+    host_cache_enabled: bool = setting('HOST_CACHE_ENABLED', True)
+    host_cache_path: str = setting('HOST_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'langstar-cache.sqlite3'))
+    host_lease_ttl: float = setting('HOST_LEASE_TTL', 30.0)
+    #set by gunicorn.conf.py, every worker then writes its samples to files in this directory
+    prometheus_multiproc_dir: str = setting('PROMETHEUS_MULTIPROC_DIR', None)
+
+    #observability and startup
+    trace_requests: bool = setting('TRACE_REQUESTS', False)
+    startup_budget_seconds: float = setting('STARTUP_BUDGET_SECONDS', 2.0)
+
+
+def _parse(kind: type, env: str, raw: str):
+    if kind is bool:
+        return raw.strip().lower() in ('1', 'true', 'yes', 'on')
+    try:
+        return kind(raw)
+    except ValueError:
+        raise ConfigError(f"{env} must be a {kind.__name__}, got {raw!r}")
+
+
+def load_settings(environ=None) -> Settings:
+    if environ is None:
+        dotenv.load_dotenv()
+        environ = os.environ
+    values = {}
+    missing = []
+    for spec in fields(Settings):
+        env = spec.metadata["env"]
+        raw = environ.get(env)
+        #blank entries, like the ones in .env.example, fall back to the default
+        if raw is None or raw.strip() == '':
+            if spec.default is REQUIRED:
+                missing.append(env)
+            continue
+        values[spec.name] = _parse(spec.type, env, raw)
+    if missing:
+        raise ConfigError(f"Missing required settings: {', '.join(missing)}")
+    return Settings(**values)
+
+
+settings = load_settings()
@@ -1,24 +1,102 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
-from pymongo.server_api import ServerApi
-from passlib.context import CryptContext
+from fastapi import Depends, HTTPException, status
 from jose import JWTError, jwt
-from datetime import datetime, timedelta
-import dotenv
-import os
-from fastapi.security import OAuth2PasswordBearer
-import google.generativeai as genai
-import json
-from basemodels.allpydmodels import *
-from utils.all_helper import *
-
-# MongoDB connection
-dotenv.load_dotenv()
-uri = os.getenv('MONGO_URI')
-client = MongoClient(uri, server_api=ServerApi('1'))
-db = client["auth_db"]
-users_collection = db["users"]
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.server_api import ServerApi
+from config import settings
+from utils.all_helper import oauth2_scheme
+from utils.metrics import mongo_command_metrics
+
+# MongoDB connection, one async client per worker opened in the app lifespan
+
+
+class Mongo:
+    def __init__(self):
+        self.client = None
+
+    def connect(self):
+        self.client = AsyncIOMotorClient(
+            settings.mongo_uri,
+            server_api=ServerApi('1'),
+            maxPoolSize=settings.mongo_max_pool_size,
+            minPoolSize=settings.mongo_min_pool_size,
+            connectTimeoutMS=settings.mongo_connect_timeout_ms,
+            serverSelectionTimeoutMS=settings.mongo_server_selection_timeout_ms,
+            socketTimeoutMS=settings.mongo_socket_timeout_ms,
+            event_listeners=[mongo_command_metrics],
+        )
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    @property
+    def auth_db(self):
+        return self.client["auth_db"]
+
+    @property
+    def users(self):
+        return self.auth_db["users"]
+
+    @property
+    def story_db(self):
+        return self.client["story_db"]
+
+    @property
+    def cache_db(self):
+        return self.client["cache_db"]
+
+
+mongo = Mongo()
+
+
+def get_db() -> Mongo:
+    return mongo
+
+
+class UserLoader:
+    #loads each user once per request, fetching only the fields the endpoint asks for
+    def __init__(self, users):
+        self.users = users
+        self._docs = {}
+        self._fields = {}
+
+    def _has(self, username: str, field: str) -> bool:
+        loaded = self._fields.get(username, set())
+        parts = field.split(".")
+        return any(".".join(parts[:i]) in loaded for i in range(1, len(parts) + 1))
+
+    @staticmethod
+    def _merge(target: dict, source: dict):
+        for key, value in source.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                UserLoader._merge(target[key], value)
+            else:
+                target[key] = value
+
+    async def get(self, username: str, *fields: str) -> dict:
+        if username in self._docs and self._docs[username] is None:
+            return None
+        missing = [field for field in fields if not self._has(username, field)]
+        if username not in self._docs or missing:
+            doc = await self.users.find_one({"username": username}, {field: 1 for field in missing} or {"_id": 1})
+            if doc is None:
+                self._docs[username] = None
+                return None
+            self._merge(self._docs.setdefault(username, {}), doc)
+            self._fields.setdefault(username, {"_id"}).update(missing)
+        return self._docs[username]
+
+    async def require(self, username: str, *fields: str) -> dict:
+        user = await self.get(username, *fields)
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+        return user
+
+
+async def get_user_loader(db: Mongo = Depends(get_db)) -> UserLoader:
+    #fastapi caches dependencies per request, so every Depends(get_user_loader) shares this instance
+    return UserLoader(db.users)
 
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
@@ -28,7 +106,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
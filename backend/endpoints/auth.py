@@ -1,15 +1,24 @@
-from fastapi import *
-from basemodels.allpydmodels import *
-from database import *
-from utils.all_helper import *
-from utils.story_helper import *
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from pymongo.errors import DuplicateKeyError
+from basemodels.allpydmodels import UserLogin, UserRegister
+from database import Mongo, get_db, UserLoader, get_user_loader
+from utils.all_helper import create_access_token, SUPPORTED_LANGUAGES
+from utils.indexes import index_manager
+from utils.password_pool import password_hasher
+from utils.llm_resilience import llm_breaker, llm_latency
 
 router = APIRouter()
 
 @router.post("/login")
-async def login(user_data: UserLogin):
-    user = users_collection.find_one({"username": user_data.username})
-    if user and pwd_context.verify(user_data.password, user["password"]):
+async def login(user_data: UserLogin, db: Mongo = Depends(get_db), users: UserLoader = Depends(get_user_loader)):
+    user = await users.get(user_data.username, "password", "languages")
+    valid, new_hash = (False, None)
+    if user:
+        valid, new_hash = await password_hasher.verify_and_update(user_data.password, user["password"])
+    if valid:
+        if new_hash:
+            #transparently upgrade hashes made with older bcrypt settings
+            await db.users.update_one({"_id": user["_id"]}, {"$set": {"password": new_hash}})
         access_token = create_access_token(
             data={"sub": user_data.username}
         )
@@ -25,8 +34,8 @@ async def login(user_data: UserLogin):
     )
 
 @router.post("/register")
-async def register(user_data: UserRegister):
-    existing_user = users_collection.find_one({"username": user_data.username})
+async def register(user_data: UserRegister, db: Mongo = Depends(get_db)):
+    existing_user = await db.users.find_one({"username": user_data.username}, {"_id": 1})
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -35,26 +44,42 @@ async def register(user_data: UserRegister):
     access_token = create_access_token(
         data={"sub": user_data.username}
     )
-    hashed_password = pwd_context.hash(user_data.password)
-    users_collection.insert_one({
-        "username": user_data.username,
-        "password": hashed_password,
-        "languages": {"SPANISH":0, "FRENCH":0, "GERMAN":0, "ITALIAN":0, "GUJARATI":0, "TELUGU":0, "JAPANESE":0},
-    })
+    hashed_password = await password_hasher.hash(user_data.password)
+    languages = {language: 0 for language in SUPPORTED_LANGUAGES}
+    try:
+        await db.users.insert_one({
+            "username": user_data.username,
+            "password": hashed_password,
+            "languages": languages,
+        })
+    except DuplicateKeyError:
+        #a concurrent registration took the name after the check above, the unique index catches it
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already exists"
+        )
     return {
         "status": "success",
         "message": "Registration successful",
         "username": user_data.username,
-        "languages": users_collection.find_one({"username": user_data.username})["languages"],
+        "languages": languages,
         "access_token": access_token,
     }
 
 #health check endpoint
 @router.get("/health")
-async def health_check():
+async def health_check(request: Request):
+    #degraded while the gemini breaker is open, the api itself still answers
+    breaker = llm_breaker.stats()
     return {
-        "status": "healthy"
+        "status": "healthy" if breaker["state"] == "closed" else "degraded",
+        "llm": {**breaker, **llm_latency.stats()},
+        "startup": getattr(request.app.state, "startup", None),
     }
+@router.get("/health/indexes")
+async def index_health():
+    return await index_manager.status()
+
 #/ endpoint
 @router.get("/")
 async def basic():
@@ -1,66 +1,71 @@
-from fastapi import *
-from basemodels.allpydmodels import *
-from utils.all_helper import *
-from utils.story_helper import *
-from database import *
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from basemodels.allpydmodels import InfoDict, LeaderboardQuery, ScoreDict, StoryStart, StoryNarrate
+from utils.all_helper import determine_user_level
+from utils.story_helper import generate_and_start_story, stream_and_start_story, save_part_narration
+from database import Mongo, get_db, UserLoader, get_user_loader
+from utils.errors import ServiceBusy, StoryPartPending
+from utils.leaderboard import leaderboard_page, user_rank
+import json
+from utils.feedback_jobs import feedback_jobs
+from utils.story_library import story_library
+from utils.story_sessions import story_sessions
+from utils.score_buffer import score_buffer
+from utils.llm_scheduler import set_llm_context, INTERACTIVE
 
 router = APIRouter()
 
 @router.post("/leaderboard")
-async def leaderboard(info_dict: InfoDict):
+async def leaderboard(info_dict: LeaderboardQuery, db: Mongo = Depends(get_db)):
     language = info_dict.language.upper()
 
-    try:    
-        # Find users who have points in the specified language
-        pipeline = [
-            {"$match": {f"languages.{language}": {"$exists": True}}},
-            {"$project": {
-                "_id": 0,
-                "username": 1,
-                "points": f"$languages.{language}"
-            }},
-            {"$sort": {"points": -1}},
-            {"$group": {
-                "_id": None,
-                "users": {"$push": "$$ROOT"}
-            }},
-            {"$unwind": {"path": "$users", "includeArrayIndex": "rank"}},
-            {"$project": {
-                "_id": 0,
-                "username": "$users.username",
-                "points": "$users.points",
-                "rank": {"$add": ["$rank", 1]}
-            }}
-        ]
-    
-        leaderboard_users = list(users_collection.aggregate(pipeline))
+    try:
+        # Served from the materialized snapshot, or the live score index before the first refresh
+        page = await leaderboard_page(db.auth_db, language, info_dict.limit, info_dict.cursor)
         return {
             "language": language,
-            "leaderboard": leaderboard_users
+            "leaderboard": page["leaderboard"],
+            "next_cursor": page["next_cursor"],
+            "refreshed_at": page["refreshed_at"]
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except:
         return{
             "language": language,
-            "leaderboard": []
+            "leaderboard": [],
+            "next_cursor": None
         }
 
 
+@router.post("/leaderboard/rank")
+async def leaderboard_rank(info_dict: InfoDict, db: Mongo = Depends(get_db)):
+    language = info_dict.language.upper()
+    rank = await user_rank(db.users, language, info_dict.username)
+    if rank is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {
+        "language": language,
+        **rank
+    }
+
+
 @router.post("/updatescore")
 async def update_score(info_dict: ScoreDict):
     language = info_dict.language.upper()
     score = info_dict.score
     current_user = info_dict.username
-    #update the current user's points in the database
-    users_collection.update_one(
-        {"username": current_user},
-        {"$inc": {f"languages.{language}": score}}
-    )
+    #buffered and flushed to the database in bulk by utils/score_buffer
+    score_buffer.add(current_user, language, score)
 
 @router.post("/getscores")
-async def get_scores(info_dict: InfoDict):
+async def get_scores(info_dict: InfoDict, users: UserLoader = Depends(get_user_loader)):
     #get the languages dict from the database of the current user
     current_user = info_dict.username
-    user_languages = users_collection.find_one({"username": current_user})["languages"]
+    user_languages = dict((await users.require(current_user, "languages"))["languages"])
+    #include increments that are still waiting in the write-behind buffer
+    for language, score in score_buffer.pending_for(current_user).items():
+        user_languages[language] = user_languages.get(language, 0) + score
     try:
         return {
             "languages": user_languages
@@ -72,21 +77,51 @@ async def get_scores(info_dict: InfoDict):
 
 #endpoint for story based learning
 @router.post("/storystart")
-async def start_story(info_dict: StoryStart):
+async def start_story(info_dict: StoryStart, users: UserLoader = Depends(get_user_loader)):
     language = info_dict.language.upper()
     current_user = info_dict.username
     #get points of the user with the current_user username for language from the database
-    user_points = users_collection.find_one({"username": current_user})["languages"][language]
-    user_id = users_collection.find_one({"username": current_user})["_id"]
+    user = await users.require(current_user, f"languages.{language}")
+    user_points = user["languages"][language]
+    user_id = user["_id"]
     level = determine_user_level(user_points)
+    set_llm_context(INTERACTIVE, current_user)
     try:
-        return await generate_and_start_story(user_id, language, level)
+        return await generate_and_start_story(story_sessions, story_library, user_id, language, level)
+    except ServiceBusy:
+        raise
     except:
         print("Error generating story")
 
+@router.post("/storystart/stream")
+async def start_story_stream(info_dict: StoryStart, users: UserLoader = Depends(get_user_loader)):
+    language = info_dict.language.upper()
+    current_user = info_dict.username
+    user = await users.require(current_user, f"languages.{language}")
+    level = determine_user_level(user["languages"][language])
+    set_llm_context(INTERACTIVE, current_user)
+
+    #newline delimited json, the first "start" line carries the title and part 1
+    async def story_events():
+        async for event in stream_and_start_story(story_sessions, story_library, user["_id"], language, level):
+            yield json.dumps(event, default=str) + "\n"
+
+    return StreamingResponse(story_events(), media_type="application/x-ndjson")
+
 @router.post("/storynarrate")
-async def submit_narration(info_dict: StoryNarrate):
+async def submit_narration(info_dict: StoryNarrate, users: UserLoader = Depends(get_user_loader)):
     transcription = info_dict.transcription
     current_user = info_dict.username
-    user_id = users_collection.find_one({"username": current_user})["_id"]
-    return await save_part_narration(user_id,  transcription)
+    user_id = (await users.require(current_user))["_id"]
+    set_llm_context(INTERACTIVE, current_user)
+    try:
+        return await save_part_narration(story_sessions, feedback_jobs, user_id,  transcription)
+    except StoryPartPending as e:
+        raise HTTPException(status_code=409, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+@router.get("/storyfeedback/{job_id}")
+async def story_feedback(job_id: str):
+    job = await feedback_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Feedback job not found")
+    return job
@@ -1,38 +1,54 @@
-from fastapi import *
-from basemodels.allpydmodels import *
-from utils.all_helper import *
-from utils.story_helper import *
-from database import *
+from fastapi import APIRouter, Depends, HTTPException
+from basemodels.allpydmodels import InfoDict, LanguageTeaching, TongueTwister, AnalyzeSpeech
+from utils.all_helper import determine_user_level, language_teaching_chat, generate_tongue_twisters, analyze_speech_transcript
+from database import UserLoader, get_user_loader
+from utils.errors import ServiceBusy
+from utils.content_pool import content_pool
+from utils.daily_content import daily_content
+from utils.story_library import story_library
+from utils.story_sessions import story_sessions
+from utils.response_cache import teacher_cache
+from utils.narration_scorer import local_speech_score
+from utils.score_buffer import score_buffer
+from utils.llm_client import single_flight
+from utils.llm_scheduler import llm_scheduler, set_llm_context, INTERACTIVE, BATCH
 
 router = APIRouter()
 
 @router.post("/dailies")
-async def dailies(info_dict: InfoDict):
+async def dailies(info_dict: InfoDict, users: UserLoader = Depends(get_user_loader)):
     language = info_dict.language.upper()
     current_user = info_dict.username
     #get points of the user with the current_user username for language from the database
-    user_points = users_collection.find_one({"username": current_user})["languages"][language]
+    user_points = (await users.require(current_user, f"languages.{language}"))["languages"][language]
     level = determine_user_level(user_points)
+    set_llm_context(BATCH, current_user)
     try:
-        dailies_data = generate_dailies(language, level)
+        dailies_data = await daily_content.get(current_user, language, level)
         return {
             "dailies": dailies_data
         }
-    except:
-        print("Error generating dailies")
+    except ServiceBusy:
+        raise
+    except Exception as e:
+        print(f"Error generating dailies: {e}")
+        raise HTTPException(status_code=500, detail="Error generating dailies")
 
 @router.post("/memorypairs")
-async def memory_pairs(info_dict: InfoDict):
+async def memory_pairs(info_dict: InfoDict, users: UserLoader = Depends(get_user_loader)):
     language = info_dict.language.upper()
     current_user = info_dict.username
-    user_points = users_collection.find_one({"username": current_user})["languages"][language]
+    user_points = (await users.require(current_user, f"languages.{language}"))["languages"][language]
     level = determine_user_level(user_points)
+    set_llm_context(BATCH, current_user)
     
     try:
-        pairs_data = generate_memory_pairs(language, level)
+        pairs_data = await content_pool.get("memory_pairs", language, level)
         return {
             "words": pairs_data
         }
+    except ServiceBusy:
+        raise
     except:
         return {
             "pairs": []
@@ -43,19 +59,41 @@ async def memory_pairs(info_dict: InfoDict):
 async def chat_with_language_teacher(
     info_dict: LanguageTeaching,
 ):
+    set_llm_context(INTERACTIVE)
     try:
-        response = language_teaching_chat(info_dict.language, info_dict.query)
+        cache_key = teacher_cache.make_key(info_dict.language, info_dict.query)
+        response = await teacher_cache.get(cache_key)
+        if response is None:
+            response = await language_teaching_chat(info_dict.language, info_dict.query)
+            await teacher_cache.set(cache_key, response)
         return {"data": response}
+    except ServiceBusy:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/cache/stats")
+async def cache_stats():
+    return {
+        "language_teacher": teacher_cache.stats(),
+        "content_pool": content_pool.stats(),
+        "llm_single_flight": single_flight.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "daily_content": daily_content.stats(),
+        "story_library": story_library.stats(),
+        "story_sessions": story_sessions.stats(),
+    }
+
 @router.post("/tongue_twisters")
 async def get_tongue_twisters(
     info_dict: TongueTwister,
 ):
+    set_llm_context(BATCH)
     try:
-        twisters = generate_tongue_twisters(language=info_dict.language)
+        twisters = await generate_tongue_twisters(language=info_dict.language)
         return {"data": twisters}
+    except ServiceBusy:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -64,7 +102,18 @@ async def analyze_speech(info_dict: AnalyzeSpeech):
     language = info_dict.language.upper()
     transcript = info_dict.transcription
     current_user = info_dict.username
-    analysis_result = analyze_speech_transcript(language, transcript)
+    set_llm_context(INTERACTIVE, current_user)
+    local_score = local_speech_score(info_dict.reference, transcript)
+    if local_score is not None:
+        #empty transcripts, and clear matches or misses against a known reference, skip gemini
+        analysis_result = {
+            "original": transcript,
+            "correct_form": info_dict.reference or transcript,
+            "alternatives": [],
+            "score": local_score
+        }
+    else:
+        analysis_result = await analyze_speech_transcript(language, transcript)
     
     # Update user's points based on the speech score
     score_to_add = int(analysis_result["score"])
@@ -72,9 +121,6 @@ async def analyze_speech(info_dict: AnalyzeSpeech):
         score_to_add = 0
     elif score_to_add >= 8 and score_to_add <= 10:
         score_to_add = 2
-    users_collection.update_one(
-        {"username": current_user},
-        {"$inc": {f"languages.{language}": score_to_add}}
-    )
+    score_buffer.add(current_user, language, score_to_add)
     
     return analysis_result
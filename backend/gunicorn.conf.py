@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+
+#prometheus_client picks multiprocess mode when it is first imported, so the directory is set
+#before the app (and config, which reads it) is preloaded
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "langstar-prometheus"))
+
+from config import settings
+
+#production entry point: gunicorn -c gunicorn.conf.py main:app
+#the app is imported once in the master and forked into the workers; mongo, gemini and the host
+#cache connections are all opened after the fork, in each worker's lifespan or on first use
+#kill -HUP <master> replaces the workers gracefully, with preload_app new code needs
+#kill -USR2 <master> (new master) followed by kill -QUIT of the old one
+bind = settings.bind
+workers = settings.web_concurrency or os.cpu_count() or 1
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+#in-flight requests, including streamed stories, get this long to finish on reload or shutdown
+graceful_timeout = 30
+timeout = 60
+keepalive = 5
+
+#recycle workers now and then, spread out so they don't all restart together
+max_requests = 10000
+max_requests_jitter = 1000
+
+
+def on_starting(server):
+    #files left by an earlier master would be added into this one's counters
+    shutil.rmtree(settings.prometheus_multiproc_dir, ignore_errors=True)
+    os.makedirs(settings.prometheus_multiproc_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
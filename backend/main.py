@@ -1,22 +1,110 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+import time
+#taken before the heavy imports below so the startup report covers them
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
-from pymongo.server_api import ServerApi
-from passlib.context import CryptContext
-from jose import JWTError, jwt
-from datetime import datetime, timedelta
-import dotenv
-import os
-from fastapi.security import OAuth2PasswordBearer
-import google.generativeai as genai
-import json
-from basemodels.allpydmodels import *
-from utils.all_helper import *
-from utils.story_helper import *
+from fastapi.responses import JSONResponse, Response
+from config import settings
+from database import mongo
 from endpoints import auth, games, games_word
-from database import *
+from utils.errors import ServiceBusy
+from utils.content_pool import content_pool
+from utils.daily_content import daily_content
+from utils.story_library import story_library
+from utils.leaderboard import LeaderboardSnapshotter
+from utils.indexes import index_manager
+from utils.host_cache import host_cache, background_lease
+from utils.feedback_jobs import feedback_jobs
+from utils.password_pool import password_hasher
+from utils.score_buffer import score_buffer
+from utils.story_sessions import story_sessions
+from utils.response_cache import teacher_cache
+from utils.llm_client import single_flight, get_model
+from utils.llm_scheduler import llm_scheduler
+from utils.llm_resilience import llm_breaker, llm_latency
+from utils.metrics import REQUEST_SECONDS, component_stats, render, server_timing, start_trace
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+leaderboard_snapshotter = LeaderboardSnapshotter(mongo, settings.leaderboard_snapshot_interval, background_lease)
+
+for name, source in {
+    "teacher_cache": teacher_cache,
+    "host_cache": host_cache,
+    "background_lease": background_lease,
+    "content_pool": content_pool,
+    "daily_content": daily_content,
+    "story_library": story_library,
+    "story_sessions": story_sessions,
+    "llm_single_flight": single_flight,
+    "llm_scheduler": llm_scheduler,
+    "llm_breaker": llm_breaker,
+    "llm_latency": llm_latency,
+}.items():
+    component_stats.register(name, source.stats)
+
+
+class StartupTimer:
+    #times each lifespan phase so a slow boot names its culprit
+    def __init__(self):
+        self.phases = {"imports": IMPORT_SECONDS}
+
+    async def run(self, name: str, step):
+        started = time.perf_counter()
+        result = step()
+        if asyncio.iscoroutine(result):
+            await result
+        self.phases[name] = time.perf_counter() - started
+
+    def report(self) -> dict:
+        total = sum(self.phases.values())
+        if total > settings.startup_budget_seconds:
+            slowest = sorted(self.phases.items(), key=lambda item: item[1], reverse=True)[:3]
+            print(f"Startup took {total:.2f}s, over the {settings.startup_budget_seconds:.2f}s budget; slowest: "
+                  + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in slowest))
+        return {"total_seconds": round(total, 4), "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()}}
 
-app = FastAPI()
+
+async def warm_up():
+    #off the startup path: building the gemini client and requeueing interrupted jobs both wait on the network
+    try:
+        await asyncio.to_thread(get_model)
+        await feedback_jobs.recover()
+    except Exception as e:
+        print(f"Background warm up failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    timer = StartupTimer()
+    await timer.run("mongo", mongo.connect)
+    await timer.run("indexes", index_manager.start)
+    await timer.run("host_lease", background_lease.start)
+    await timer.run("content_pool", lambda: content_pool.start(warm=settings.content_pool_warm))
+    await timer.run("daily_content", daily_content.start)
+    await timer.run("story_library", story_library.start)
+    await timer.run("leaderboard", leaderboard_snapshotter.start)
+    await timer.run("score_buffer", score_buffer.start)
+    app.state.startup = timer.report()
+    warming = asyncio.create_task(warm_up())
+    yield
+    warming.cancel()
+    await score_buffer.stop()
+    await feedback_jobs.stop()
+    password_hasher.shutdown()
+    await leaderboard_snapshotter.stop()
+    await story_library.stop()
+    await daily_content.stop()
+    await background_lease.stop()
+    await content_pool.stop()
+    await index_manager.stop()
+    mongo.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS for React frontend
 app.add_middleware(
@@ -32,12 +120,33 @@ app.include_router(auth.router, tags=["Auth"])
 app.include_router(games.router, tags=["Games"])
 app.include_router(games_word.router, tags=["Games"])
 
+@app.exception_handler(ServiceBusy)
+async def service_busy_handler(request, exc: ServiceBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 @app.middleware("http")
 async def add_cors_header(request, call_next):
+    spans = start_trace(request)
+    started = time.perf_counter()
     response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    #label by route template so path parameters don't explode the series count
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(request.method, route.path if route else "unmatched", str(response.status_code)).observe(elapsed)
+    if spans is not None:
+        response.headers["Server-Timing"] = server_timing(spans, elapsed)
     response.headers["Access-Control-Allow-Origin"] = "*"
     return response
 
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
+
 #logout endpoint
 @app.post("/logout")
 async def logout():
@@ -49,5 +158,6 @@ async def logout():
 
 
 if __name__ == "__main__":
+    #single process for development, production runs several workers: gunicorn -c gunicorn.conf.py main:app
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,29 @@
+from utils.json_stream import IncrementalJSONParser
+
+
+def parse(text: str, max_depth: int = 1):
+    parser = IncrementalJSONParser(max_depth=max_depth)
+    events = []
+    #fed a few characters at a time, the way gemini streams
+    for start in range(0, len(text), 7):
+        events.extend(parser.feed(text[start:start + 7]))
+    return parser, dict(events)
+
+
+def test_malformed_value_is_dropped_and_the_rest_kept():
+    parser, fields = parse('{"original": "hola", "correct_form": "hola", "score": 8/10}')
+    assert fields == {("original",): "hola", ("correct_form",): "hola"}
+    assert parser.done
+
+
+def test_single_quoted_keys_give_no_fields():
+    parser, fields = parse("{'original': 'hola', 'score': 8}")
+    assert not [path for path in fields if isinstance(path[0], str)]
+    assert not parser.done
+
+
+def test_brackets_in_chatter_before_the_document_are_skipped():
+    parser, fields = parse('Here is [the] JSON: {"score": 8, "alternatives": ["a", "b",],}\n```')
+    assert parser.done
+    assert parser.value == {"score": 8, "alternatives": ["a", "b"]}
+    assert fields == {("score",): 8, ("alternatives",): ["a", "b"]}
@@ -0,0 +1,37 @@
+import asyncio
+import time
+from contextlib import aclosing
+from types import SimpleNamespace
+from utils.llm_client import set_model, stream_text
+from utils.llm_resilience import llm_breaker
+from utils.metrics import llm_helper, registry
+
+
+class StreamingModel:
+    #gemini stand-in that streams a JSON document followed by chatter
+    async def generate_content_async(self, prompt, stream=False):
+        async def chunks():
+            for text in ('{"score": 8}', " hope this helps!"):
+                yield SimpleNamespace(text=text)
+        return chunks()
+
+
+def test_stream_closed_early_still_counts_as_a_success(monkeypatch):
+    set_model(StreamingModel())
+    #half open, so this call is the probe that closes the breaker again
+    monkeypatch.setattr(llm_breaker, "opened_at", time.monotonic() - llm_breaker.reset_after - 1)
+
+    async def read_first_chunk():
+        with llm_helper("StreamTest"):
+            async with aclosing(stream_text("prompt")) as chunks:
+                async for chunk in chunks:
+                    return chunk
+
+    try:
+        assert asyncio.run(read_first_chunk()) == '{"score": 8}'
+    finally:
+        set_model(None)
+    assert llm_breaker.state == llm_breaker.CLOSED
+    assert not llm_breaker.probing
+    assert registry.get_sample_value("langstar_llm_response_chars_total", {"helper": "StreamTest"}) == len('{"score": 8}')
+    assert registry.get_sample_value("langstar_llm_call_seconds_count", {"helper": "StreamTest", "outcome": "ok"}) == 1
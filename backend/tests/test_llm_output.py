@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+from basemodels.allpydmodels import SpeechAnalysisResult
+from utils import llm_output
+from utils.llm_output import StructuredOutputError, generate_structured
+
+
+def scripted(monkeypatch, *answers):
+    #generate_text stand-in that gives one canned answer per call and records the prompts
+    prompts = []
+    queue = list(answers)
+
+    async def fake_generate_text(prompt, share=True):
+        prompts.append(prompt)
+        return queue.pop(0)
+
+    monkeypatch.setattr(llm_output, "generate_text", fake_generate_text)
+    monkeypatch.setattr(llm_output.settings, "llm_repair_attempts", 1)
+    return prompts
+
+
+GOOD = '{"original": "hola", "correct_form": "hola", "alternatives": ["buenas"], "score": "8/10"}'
+
+
+def test_malformed_value_is_repaired(monkeypatch):
+    prompts = scripted(
+        monkeypatch,
+        '```json\n{"original": "hola", "correct_form": "hola", "alternatives": ["buenas"], "score": 8/10}\n```',
+        '{"score": 8}',
+    )
+    result = asyncio.run(generate_structured("analyze", SpeechAnalysisResult))
+    assert result["score"] == 8
+    assert result["original"] == "hola"
+    assert "score" in prompts[1]
+
+
+def test_unparseable_answer_asks_the_whole_question_again(monkeypatch):
+    prompts = scripted(monkeypatch, "{'original': 'hola', 'score': 8}", GOOD)
+    result = asyncio.run(generate_structured("analyze", SpeechAnalysisResult))
+    assert result["alternatives"] == ["buenas"]
+    assert prompts == ["analyze", "analyze"]
+
+
+def test_chatter_with_brackets_before_the_document(monkeypatch):
+    scripted(monkeypatch, "Here is [the] JSON: " + GOOD)
+    result = asyncio.run(generate_structured("analyze", SpeechAnalysisResult))
+    assert result["score"] == 8
+
+
+def test_gives_up_with_structured_output_error(monkeypatch):
+    scripted(monkeypatch, "no json here", "still none")
+    with pytest.raises(StructuredOutputError):
+        asyncio.run(generate_structured("analyze", SpeechAnalysisResult))
@@ -0,0 +1,137 @@
+import asyncio
+from mongomock_motor import AsyncMongoMockClient
+from database import Mongo
+from utils import story_helper
+from utils.feedback_jobs import FeedbackJobs
+from utils.story_helper import activate_story, save_part_narration
+from utils.story_sessions import StorySessions
+
+
+def story(title: str, first_part: str) -> dict:
+    return {
+        "title": title,
+        "title_english": title,
+        "parts": [
+            {"part_number": number, "content": first_part if number == 1 else f"{title} part {number}", "translation": "", "description": ""}
+            for number in range(1, 6)
+        ],
+    }
+
+
+def shared_mongo() -> Mongo:
+    mongo = Mongo()
+    mongo.client = AsyncMongoMockClient()
+    return mongo
+
+
+async def no_gemini(*args, **kwargs):
+    raise AssertionError("the narrations in these tests are scored locally")
+
+
+def test_retry_after_restart_evaluates_the_new_story(monkeypatch):
+    monkeypatch.setattr(story_helper, "generate_structured", no_gemini)
+
+    async def scenario():
+        mongo = shared_mongo()
+        worker_a = StorySessions(mongo, 10)
+        worker_b = StorySessions(mongo, 10)
+        first = "el gato duerme en la casa"
+        await activate_story(worker_a, "user", "SPANISH", "beginner", story("uno", first))
+        #the user restarts through another worker, worker a still caches the first story
+        await activate_story(worker_b, "user", "SPANISH", "beginner", story("dos", "mañana vamos juntos al mercado grande"))
+
+        result = await save_part_narration(worker_a, None, "user", first)
+
+        stored = await mongo.story_db.active_stories.find_one({"user_id": "user"})
+        return result, stored
+
+    result, stored = asyncio.run(scenario())
+    assert stored["title"] == "dos"
+    assert stored["current_part"] == 2
+    feedback = stored["parts"][0]["user_narration"]["feedback"]
+    assert feedback == result["current_feedback"]
+    assert feedback["accuracy_score"] < 30
+
+
+def test_retry_on_the_same_story_reuses_the_feedback(monkeypatch):
+    monkeypatch.setattr(story_helper, "generate_structured", no_gemini)
+    evaluations = []
+    evaluate = story_helper.evaluate_user_narration
+
+    async def counting(*args):
+        evaluations.append(args)
+        return await evaluate(*args)
+
+    monkeypatch.setattr(story_helper, "evaluate_user_narration", counting)
+
+    async def scenario():
+        mongo = shared_mongo()
+        worker_a = StorySessions(mongo, 10)
+        worker_b = StorySessions(mongo, 10)
+        first = "el gato duerme en la casa"
+        started = await activate_story(worker_a, "user", "SPANISH", "beginner", story("uno", first))
+        #another worker touches the same story, so worker a's cached version is stale
+        await worker_b.update(started, {"$set": {"level": "beginner"}})
+        return await save_part_narration(worker_a, None, "user", first)
+
+    result = asyncio.run(scenario())
+    assert result["status"] == "in_progress"
+    assert result["current_feedback"]["accuracy_score"] == 100.0
+    assert len(evaluations) == 1
+
+
+def test_streamed_parts_land_after_a_narration():
+    async def scenario():
+        mongo = shared_mongo()
+        sessions = StorySessions(mongo, 10)
+        streamed = story("uno", "el gato duerme en la casa")
+        started = await activate_story(sessions, "user", "SPANISH", "beginner", {**streamed, "parts": streamed["parts"][:2]})
+        #the user narrates part 1 while the rest of the story is still streaming
+        await save_part_narration(sessions, None, "user", "el gato duerme en la casa")
+        pushed = await sessions.amend(started, {"$push": {"parts": streamed["parts"][2]}})
+        return pushed
+
+    pushed = asyncio.run(scenario())
+    assert pushed is not None
+    assert len(pushed["parts"]) == 3
+    assert pushed["current_part"] == 2
+    assert pushed["parts"][0]["user_narration"] is not None
+
+
+def test_archiving_keeps_a_story_started_meanwhile():
+    async def scenario():
+        mongo = shared_mongo()
+        worker_a = StorySessions(mongo, 10)
+        worker_b = StorySessions(mongo, 10)
+        finished = await activate_story(worker_a, "user", "SPANISH", "beginner", story("uno", "el gato duerme en la casa"))
+        #the user starts the next story on another worker before the first one is archived
+        await activate_story(worker_b, "user", "SPANISH", "beginner", story("dos", "mañana vamos juntos al mercado grande"))
+        await FeedbackJobs(mongo, worker_a).archive_story(finished)
+        return await mongo.story_db.active_stories.find_one({"user_id": "user"})
+
+    active = asyncio.run(scenario())
+    assert active is not None
+    assert active["title"] == "dos"
+
+
+def test_retried_last_narration_gets_the_same_job(monkeypatch):
+    monkeypatch.setattr(story_helper, "generate_structured", no_gemini)
+    spawned = []
+    monkeypatch.setattr(FeedbackJobs, "_spawn", lambda self, job_id: spawned.append(job_id))
+
+    async def scenario():
+        mongo = shared_mongo()
+        sessions = StorySessions(mongo, 10)
+        jobs = FeedbackJobs(mongo, sessions)
+        started = await activate_story(sessions, "user", "SPANISH", "beginner", story("uno", "el gato duerme en la casa"))
+        await sessions.update(started, {"$set": {"current_part": 5}})
+        first = await save_part_narration(sessions, jobs, "user", "uno part 5")
+        #the answer never reached the client, which sends the same narration again
+        retried = await save_part_narration(sessions, jobs, "user", "uno part 5")
+        return first, retried, await mongo.story_db.completed_stories.count_documents({})
+
+    first, retried, archived = asyncio.run(scenario())
+    assert first["status"] == retried["status"] == "completed"
+    assert retried["job_id"] == first["job_id"]
+    assert len(spawned) == 1
+    assert archived == 1
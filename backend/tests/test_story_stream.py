@@ -0,0 +1,74 @@
+import asyncio
+import json
+from mongomock_motor import AsyncMongoMockClient
+from database import Mongo
+from utils import story_helper
+from utils.story_helper import stream_and_start_story
+from utils.story_sessions import StorySessions
+
+
+STORY = {
+    "title": "uno",
+    "title_english": "one",
+    "parts": [
+        {"part_number": number, "content": f"parte {number}", "translation": f"part {number}", "description": "a scene"}
+        for number in range(1, 6)
+    ],
+}
+
+
+class EmptyLibrary:
+    async def take(self, user_id, language, level):
+        return None
+
+    async def add(self, language, level, story):
+        return None
+
+    async def mark_seen(self, user_id, language, level, story_id):
+        pass
+
+
+async def slow_gemini(prompt):
+    #a fenced answer in small chunks, slow enough that the client leaves after the first part
+    text = "```json\n" + json.dumps(STORY) + "\n```"
+    for start in range(0, len(text), 40):
+        await asyncio.sleep(0.01)
+        yield text[start:start + 40]
+
+
+def test_disconnect_after_start_still_stores_the_whole_story(monkeypatch):
+    monkeypatch.setattr(story_helper, "stream_text", slow_gemini)
+
+    async def scenario():
+        mongo = Mongo()
+        mongo.client = AsyncMongoMockClient()
+        sessions = StorySessions(mongo, 10)
+        events = stream_and_start_story(sessions, EmptyLibrary(), "user", "SPANISH", "beginner")
+        first = await events.__anext__()
+        #the client goes away, starlette closes the response generator
+        await events.aclose()
+        await asyncio.gather(*story_helper._story_writers)
+        return first, await mongo.story_db.active_stories.find_one({"user_id": "user"})
+
+    first, stored = asyncio.run(scenario())
+    assert first["event"] == "start"
+    assert len(stored["parts"]) == 5
+    assert stored["title"] == "uno"
+
+
+def test_cancelled_writer_removes_the_partial_story(monkeypatch):
+    monkeypatch.setattr(story_helper, "stream_text", slow_gemini)
+
+    async def scenario():
+        mongo = Mongo()
+        mongo.client = AsyncMongoMockClient()
+        sessions = StorySessions(mongo, 10)
+        events = stream_and_start_story(sessions, EmptyLibrary(), "user", "SPANISH", "beginner")
+        await events.__anext__()
+        await events.aclose()
+        for writer in list(story_helper._story_writers):
+            writer.cancel()
+        await asyncio.gather(*story_helper._story_writers, return_exceptions=True)
+        return await mongo.story_db.active_stories.find_one({"user_id": "user"})
+
+    assert asyncio.run(scenario()) is None
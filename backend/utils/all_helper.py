@@ -1,38 +1,26 @@
-from passlib.context import CryptContext
-from jose import JWTError, jwt
 from datetime import datetime, timedelta
-import dotenv
-import os
+from jose import jwt
+from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
-import google.generativeai as genai
-import json
-from pymongo import MongoClient
-from pymongo.server_api import ServerApi
-
-# Database setup
-dotenv.load_dotenv()
-uri = os.getenv('MONGO_URI')
-client = MongoClient(uri, server_api=ServerApi('1'))
-storydb = client["story_db"]
-
-#gemini model
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-model = genai.GenerativeModel('gemini-pro')
+from config import settings
+from utils.llm_output import generate_structured
+from basemodels.allpydmodels import DailiesSet, MemoryPairsSet, LanguageContent, TeacherResponse, TongueTwisterSet, SpeechAnalysisResult
 
 # Security configurations
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-SECRET_KEY = os.getenv('SECRET_KEY')
-ALGORITHM = os.getenv('ALGORITHM')
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES'))
+#hashes below bcrypt_rounds report needs_update and are rehashed on the next login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=settings.bcrypt_rounds, bcrypt__min_rounds=settings.bcrypt_rounds)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
     return encoded_jwt
 
+SUPPORTED_LANGUAGES = ["SPANISH", "FRENCH", "GERMAN", "ITALIAN", "GUJARATI", "TELUGU", "JAPANESE"]
+LEVELS = ["beginner", "intermediate", "advanced"]
+
 #determine level
 def determine_user_level(points: int) -> str:
     if points < 100:
@@ -43,7 +31,7 @@ def determine_user_level(points: int) -> str:
         return "advanced"
 
 #generating dailies
-def generate_dailies(language: str, level: str) -> dict:
+async def generate_dailies(language: str, level: str) -> dict:
     prompt = f"""Generate 10 flashcards for {language} language learning at {level} level.
     Return only a JSON array with this exact structure:
     {{
@@ -59,18 +47,11 @@ def generate_dailies(language: str, level: str) -> dict:
             }}
         ]
     }}"""
-    response = model.generate_content(prompt)
-    # Remove markdown formatting and clean the string
-    cleaned_text = response.text.strip()
-    cleaned_text = cleaned_text.replace('```json\n', '').replace('\n```', '')
-    # Remove any extra newlines and spaces
-    cleaned_text = ''.join(line.strip() for line in cleaned_text.splitlines())
-    
-    return json.loads(cleaned_text)
+    return await generate_structured(prompt, DailiesSet)
 
 
 #generate word pairs for memory game
-def generate_memory_pairs(language: str, level: str) -> dict:
+async def generate_memory_pairs(language: str, level: str) -> dict:
     prompt = f"""Generate 10 word/phrase pairs for a memory matching game in {language} at {level} level so that the user is able to learn some good, effective things to say in that language.
     Return only a JSON object with this exact structure:
     {{
@@ -85,15 +66,49 @@ def generate_memory_pairs(language: str, level: str) -> dict:
     }}
     Make sure the words/phrases are appropriate for {level} level learners, and if you give phrases, don't make them too long. Also, make sure to give some phrases and some words."""
     
-    response = model.generate_content(prompt)
-    cleaned_text = response.text.strip()
-    cleaned_text = cleaned_text.replace('```json\n', '').replace('\n```', '')
-    cleaned_text = ''.join(line.strip() for line in cleaned_text.splitlines())
-    
-    return json.loads(cleaned_text)
+    return await generate_structured(prompt, MemoryPairsSet)
+
 
+#dailies and memory pairs for every level of a language in one call, split up by the content pool
+async def generate_language_content(language: str) -> dict:
+    prompt = f"""Generate {language} language learning content for each of these levels: {", ".join(LEVELS)}.
+    For every level give 10 flashcards and 10 word/phrase pairs for a memory matching game, all appropriate for learners at that level.
+    Memory pairs should mix words and short phrases that are good, effective things to say in {language}.
+    Return only a JSON object with this exact structure:
+    {{
+        "beginner": {{
+            "dailies": {{
+                "cards": [
+                    {{
+                        "new_concept": "concept in {language}",
+                        "concept_pronunciation": "pronunciation of the concept in english",
+                        "english": "english translation",
+                        "meaning": "detailed explanation",
+                        "example": "example sentence in {language}",
+                        "example_pronunciation": "pronunciation of the example sentence in english",
+                        "translation": "translation of the example sentence"
+                    }}
+                ]
+            }},
+            "memory_pairs": {{
+                "pairs": [
+                    [
+                        "word/phrase in {language}",
+                        "english translation",
+                        "english pronunciation of the word/phrase."
+                    ]
+                ]
+            }}
+        }},
+        "intermediate": {{ same structure as beginner }},
+        "advanced": {{ same structure as beginner }}
+    }}"""
+    #streamed so the long answer is bounded per chunk rather than as a whole, and a truncated
+    #answer keeps the levels that did complete and only repairs the rest
+    return await generate_structured(prompt, LanguageContent, stream=True)
 
-def language_teaching_chat(language: str, user_query: str) -> dict:
+
+async def language_teaching_chat(language: str, user_query: str) -> dict:
     prompt = f"""As a language teaching assistant for {language}, respond to: {user_query}, with answers related to {language}.
     
     Return response in this JSON structure:
@@ -105,14 +120,9 @@ def language_teaching_chat(language: str, user_query: str) -> dict:
     
     Focus on providing clear explanations with practical examples."""
     
-    response = model.generate_content(prompt)
-    cleaned_text = response.text.strip()
-    cleaned_text = cleaned_text.replace('```json\n', '').replace('\n```', '')
-    cleaned_text = ''.join(line.strip() for line in cleaned_text.splitlines())
-    
-    return json.loads(cleaned_text)
+    return await generate_structured(prompt, TeacherResponse)
 
-def generate_tongue_twisters(language: str) -> dict:
+async def generate_tongue_twisters(language: str) -> dict:
     prompt = f"""Generate 5 fun and challenging tongue twisters in {language} at five different difficulty levels.
     
     Return only a JSON object with this structure:
@@ -126,15 +136,10 @@ def generate_tongue_twisters(language: str) -> dict:
         ]
     }}"""
     
-    response = model.generate_content(prompt)
-    cleaned_text = response.text.strip()
-    cleaned_text = cleaned_text.replace('```json\n', '').replace('\n```', '')
-    cleaned_text = ''.join(line.strip() for line in cleaned_text.splitlines())
-    
-    return json.loads(cleaned_text)
+    return await generate_structured(prompt, TongueTwisterSet)
 
 #function to teach sentence transformations based on the sentence given by user
-def analyze_speech_transcript(language: str, transcript: str) -> dict:
+async def analyze_speech_transcript(language: str, transcript: str) -> dict:
     prompt = f"""Analyze this {language} speech transcript: "{transcript}"
     
     Return only a JSON object with this exact structure:
@@ -149,9 +154,4 @@ def analyze_speech_transcript(language: str, transcript: str) -> dict:
     
     Focus on natural speech patterns and common expressions in {language}."""
     
-    response = model.generate_content(prompt)
-    cleaned_text = response.text.strip()
-    cleaned_text = cleaned_text.replace('```json\n', '').replace('\n```', '')
-    cleaned_text = ''.join(line.strip() for line in cleaned_text.splitlines())
-    
-    return json.loads(cleaned_text)
+    return await generate_structured(prompt, SpeechAnalysisResult)
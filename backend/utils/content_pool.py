@@ -0,0 +1,244 @@
+import asyncio
+import random
+import uuid
+from config import settings
+from utils.all_helper import SUPPORTED_LANGUAGES, LEVELS, generate_dailies, generate_memory_pairs, generate_language_content
+from utils.host_cache import host_cache, background_lease
+from utils.llm_scheduler import set_llm_context, PREFETCH
+from utils.errors import LLMUnavailable
+
+#pool of ready-made dailies / memory pair sets per (kind, language, level)
+#the sets live in the host cache, so every worker on the host serves the same pools and a restarted
+#worker starts warm; only the worker holding the background lease refills them
+#each set is written once to its own row, the pool row only holds set ids and use counts, so a take
+#rewrites a few bytes instead of every set in the pool
+POOL_RETRY_DELAY = 5
+#how often the lease holder looks for pools other workers have drained
+POOL_CHECK_INTERVAL = 10
+#a pool nobody reads for this long is dropped, every take pushes it out again
+POOL_HOST_TTL = 7 * 24 * 3600
+POOL_NAMESPACE = "content_pool"
+POOL_SET_NAMESPACE = "content_pool_sets"
+
+
+def _pool_key(key: tuple) -> str:
+    return ":".join(key)
+
+
+def _set_key(key: tuple, set_id: str) -> str:
+    return f"{_pool_key(key)}:{set_id}"
+
+
+def _new_pool() -> dict:
+    #sets is [set_id, uses] in serving order, retired the ids of used up sets, oldest first
+    return {"sets": [], "retired": []}
+
+
+class ContentPool:
+    def __init__(self, host, lease, generators: dict, target_size: int, low_water: int, max_uses: int, batch_generator=None):
+        self.host = host
+        self.lease = lease
+        self.generators = generators
+        #batch_generator(language) returns {level: {kind: set}} for every level and kind in one call
+        self.batch_generator = batch_generator
+        self.target_size = target_size
+        self.low_water = low_water
+        self.max_uses = max_uses
+        self.warm = False
+        self.batch_calls = 0
+        self._sizes = {}
+        self._refill_queue = asyncio.Queue()
+        self._queued = set()
+        self._worker = None
+        self._watcher = None
+
+    def _keys(self) -> list:
+        return [(kind, language, level) for kind in self.generators for language in SUPPORTED_LANGUAGES for level in LEVELS]
+
+    def _take(self, pool: dict):
+        #round robin over the pool, retiring a set once it has been served max_uses times
+        if not pool or not pool["sets"]:
+            return None, None
+        set_id, uses = pool["sets"].pop(0)
+        uses += 1
+        dropped = None
+        if uses < self.max_uses:
+            pool["sets"].append([set_id, uses])
+        else:
+            #retired sets are the fallback while gemini is down
+            pool["retired"].append(set_id)
+            if len(pool["retired"]) > self.target_size:
+                dropped = pool["retired"].pop(0)
+        return pool, (set_id, len(pool["sets"]), dropped)
+
+    @staticmethod
+    def _discard(set_id: str):
+        def discard(pool):
+            if not pool:
+                return None, None
+            pool["sets"] = [entry for entry in pool["sets"] if entry[0] != set_id]
+            pool["retired"] = [retired for retired in pool["retired"] if retired != set_id]
+            return pool, len(pool["sets"])
+        return discard
+
+    async def _load(self, key: tuple, set_id: str):
+        #a set row that expired or can't be read is dropped from the pool, the caller falls back as on a cold pool
+        data = await self.host.get(POOL_SET_NAMESPACE, _set_key(key, set_id))
+        if data is None:
+            await self.host.update(POOL_NAMESPACE, _pool_key(key), self._discard(set_id), POOL_HOST_TTL)
+        return data
+
+    async def _take_retired(self, key: tuple):
+        pool = await self.host.get(POOL_NAMESPACE, _pool_key(key))
+        if not pool or not pool["retired"]:
+            return None
+        return await self._load(key, random.choice(pool["retired"]))
+
+    async def _size(self, key: tuple) -> int:
+        #None for a pool that was never filled, a plain read so the watcher never waits on the write lock
+        pool = await self.host.get(POOL_NAMESPACE, _pool_key(key))
+        if pool is None:
+            return None
+        size = len(pool["sets"])
+        self._sizes[key] = size
+        return size
+
+    async def _add(self, key: tuple, data: dict) -> int:
+        #the set row goes in first, so no worker ever takes an id it can't read
+        set_id = uuid.uuid4().hex
+        if not await self.host.update(POOL_SET_NAMESPACE, _set_key(key, set_id), lambda _: (data, True), POOL_HOST_TTL):
+            raise RuntimeError(f"Could not store a content pool set for {key}")
+
+        def add(pool):
+            pool = pool or _new_pool()
+            pool["sets"].append([set_id, 0])
+            return pool, len(pool["sets"])
+
+        size = await self.host.update(POOL_NAMESPACE, _pool_key(key), add, POOL_HOST_TTL)
+        if size is None:
+            raise RuntimeError(f"Could not store a content pool set for {key}")
+        self._sizes[key] = size
+        return size
+
+    def _schedule_refill(self, key: tuple):
+        #the other workers leave it to the lease holder's watcher
+        if self.lease.held and key not in self._queued:
+            self._queued.add(key)
+            self._refill_queue.put_nowait(key)
+
+    async def get(self, kind: str, language: str, level: str) -> dict:
+        key = (kind, language, level)
+        taken = await self.host.update(POOL_NAMESPACE, _pool_key(key), self._take, POOL_HOST_TTL)
+        data = None
+        if taken is not None:
+            set_id, remaining, dropped = taken
+            if dropped is not None:
+                await self.host.delete(POOL_SET_NAMESPACE, _set_key(key, dropped))
+            data = await self._load(key, set_id)
+        if data is None:
+            #cold pool, generate inline for this request and keep the set for the next ones
+            try:
+                data = await self.generators[kind](language, level)
+            except LLMUnavailable:
+                retired = await self._take_retired(key)
+                if retired is None:
+                    raise
+                return retired
+            try:
+                remaining = await self._add(key, data)
+            except RuntimeError as e:
+                print(e)
+                return data
+        self._sizes[key] = remaining
+        if remaining < self.low_water:
+            self._schedule_refill(key)
+        return data
+
+    async def _short_keys(self, language: str) -> list:
+        keys = [(kind, language, level) for kind in self.generators for level in LEVELS]
+        return [key for key in keys if (await self._size(key) or 0) < self.target_size]
+
+    async def _refill_language(self, language: str):
+        #every set in the answer goes to its own pool, as long as that pool is still short
+        content = await self.batch_generator(language)
+        self.batch_calls += 1
+        for level, sets in content.items():
+            for kind, data in sets.items():
+                key = (kind, language, level)
+                if kind in self.generators and (await self._size(key) or 0) < self.target_size:
+                    await self._add(key, data)
+
+    async def _refill(self, key: tuple):
+        kind, language, level = key
+        use_batch = self.batch_generator is not None
+        while (await self._size(key) or 0) < self.target_size:
+            #one call per language when several of its pools are short, warming all 7 takes 7 calls instead of 42
+            if use_batch and len(await self._short_keys(language)) > 1:
+                try:
+                    await self._refill_language(language)
+                    continue
+                except Exception as e:
+                    print(f"Error batch generating {language} content, refilling {key} on its own: {e}")
+                    use_batch = False
+            await self._add(key, await self.generators[kind](language, level))
+
+    async def _run(self):
+        #refills only use what interactive and on-demand requests leave over
+        set_llm_context(PREFETCH)
+        while True:
+            key = await self._refill_queue.get()
+            try:
+                if self.lease.held:
+                    await self._refill(key)
+            except Exception as e:
+                print(f"Error refilling content pool {key}: {e}")
+                await asyncio.sleep(POOL_RETRY_DELAY)
+            finally:
+                self._queued.discard(key)
+
+    async def _watch(self):
+        #requests on any worker drain the shared pools, the lease holder tops them up
+        while True:
+            if self.lease.held:
+                for key in self._keys():
+                    try:
+                        size = await self._size(key)
+                    except Exception as e:
+                        print(f"Error checking content pool {key}: {e}")
+                        continue
+                    if size is None and self.warm or size is not None and size < self.low_water:
+                        self._schedule_refill(key)
+            await asyncio.sleep(POOL_CHECK_INTERVAL)
+
+    def start(self, warm: bool = False):
+        #warm fills pools nobody has asked for yet, whichever worker holds the lease when it looks
+        self.warm = warm
+        self._worker = asyncio.create_task(self._run())
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        for task in (self._worker, self._watcher):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._worker = None
+        self._watcher = None
+
+    def stats(self) -> dict:
+        #sizes as this worker last saw them in the host cache
+        sizes = {f"{kind}:{language}:{level}": size for (kind, language, level), size in self._sizes.items()}
+        return {**sizes, "batch_calls": self.batch_calls}
+
+
+content_pool = ContentPool(
+    host_cache,
+    background_lease,
+    {"dailies": generate_dailies, "memory_pairs": generate_memory_pairs},
+    target_size=settings.content_pool_target_size,
+    low_water=settings.content_pool_low_water,
+    max_uses=settings.content_pool_max_uses,
+    batch_generator=generate_language_content,
+)
@@ -0,0 +1,153 @@
+import asyncio
+from datetime import datetime, timedelta, time as dt_time
+from zoneinfo import ZoneInfo
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from config import settings
+from database import mongo
+from utils.all_helper import determine_user_level
+from utils.content_pool import content_pool
+from utils.host_cache import host_cache, background_lease
+from utils.llm_scheduler import set_llm_context, PREFETCH
+
+#one dailies set per (user, language, calendar day), generated on first open and kept until the day is over
+DAILIES_TIMEZONE = ZoneInfo(settings.dailies_timezone)
+DAILIES_PREFETCH_CHECK = 600
+
+
+def day_key(now: datetime = None) -> str:
+    now = now or datetime.now(DAILIES_TIMEZONE)
+    return now.astimezone(DAILIES_TIMEZONE).date().isoformat()
+
+
+def day_expiry(day: str) -> datetime:
+    #naive utc like every other timestamp we store, the ttl monitor removes the set after retention
+    start = datetime.combine(datetime.fromisoformat(day).date(), dt_time(), DAILIES_TIMEZONE)
+    end = start + timedelta(days=1 + settings.dailies_retention_days)
+    return end.astimezone(ZoneInfo('UTC')).replace(tzinfo=None)
+
+
+def _doc_id(username: str, language: str, day: str) -> str:
+    return f"{username}:{language}:{day}"
+
+
+class DailyContent:
+    def __init__(self, mongo, pool, host, lease):
+        self.mongo = mongo
+        self.pool = pool
+        self.host = host
+        self.lease = lease
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self._task = None
+        self._prefetched_day = None
+
+    @property
+    def collection(self):
+        return self.mongo.cache_db.user_dailies
+
+    async def _store(self, username: str, language: str, day: str, level: str, dailies: dict) -> dict:
+        #$setOnInsert so two tabs opening the screen at once end up with the same set
+        try:
+            doc = await self.collection.find_one_and_update(
+                {"_id": _doc_id(username, language, day)},
+                {"$setOnInsert": {
+                    "username": username,
+                    "language": language,
+                    "day": day,
+                    "level": level,
+                    "dailies": dailies,
+                    "expires_at": day_expiry(day),
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            doc = await self.collection.find_one({"_id": _doc_id(username, language, day)})
+        return doc["dailies"]
+
+    async def _remember(self, doc_id: str, day: str, dailies: dict) -> dict:
+        #the set never changes within its day, so every worker on the host can serve it from the shared file
+        ttl = (day_expiry(day) - datetime.utcnow()).total_seconds()
+        await self.host.set("user_dailies", doc_id, dailies, ttl)
+        return dailies
+
+    async def get(self, username: str, language: str, level: str) -> dict:
+        day = day_key()
+        doc_id = _doc_id(username, language, day)
+        dailies = await self.host.get("user_dailies", doc_id)
+        if dailies is not None:
+            self.hits += 1
+            return dailies
+        doc = await self.collection.find_one({"_id": doc_id}, {"dailies": 1})
+        if doc is not None:
+            self.hits += 1
+            return await self._remember(doc_id, day, doc["dailies"])
+        self.misses += 1
+        dailies = await self.pool.get("dailies", language, level)
+        return await self._remember(doc_id, day, await self._store(username, language, day, level, dailies))
+
+    def _active_users(self, since: str):
+        #anyone who opened dailies in the last few days, per language
+        return self.collection.aggregate([
+            {"$match": {"day": {"$gte": since}}},
+            {"$group": {"_id": {"username": "$username", "language": "$language"}}},
+        ])
+
+    async def prefetch(self, day: str):
+        today = datetime.now(DAILIES_TIMEZONE)
+        since = day_key(today - timedelta(days=settings.dailies_active_days))
+        async for group in self._active_users(since):
+            username, language = group["_id"]["username"], group["_id"]["language"]
+            if await self.collection.find_one({"_id": _doc_id(username, language, day)}, {"_id": 1}):
+                continue
+            user = await self.mongo.users.find_one({"username": username}, {f"languages.{language}": 1})
+            if user is None:
+                continue
+            level = determine_user_level(user.get("languages", {}).get(language, 0))
+            try:
+                dailies = await self.pool.get("dailies", language, level)
+            except Exception as e:
+                print(f"Error prefetching dailies for {username} {language}: {e}")
+                continue
+            await self._store(username, language, day, level, dailies)
+            self.prefetched += 1
+
+    def _in_prefetch_window(self, now: datetime) -> bool:
+        start, end = (int(hour) for hour in settings.dailies_prefetch_hours.split('-'))
+        return start <= now.hour < end
+
+    async def _run(self):
+        #off-peak, tomorrow's sets are generated for recently active users at prefetch priority
+        set_llm_context(PREFETCH)
+        while True:
+            now = datetime.now(DAILIES_TIMEZONE)
+            tomorrow = day_key(now + timedelta(days=1))
+            #one worker per host prefetches, the others would only find the sets already stored
+            if self.lease.held and self._in_prefetch_window(now) and self._prefetched_day != tomorrow:
+                try:
+                    await self.prefetch(tomorrow)
+                    self._prefetched_day = tomorrow
+                except Exception as e:
+                    print(f"Error prefetching dailies for {tomorrow}: {e}")
+            await asyncio.sleep(DAILIES_PREFETCH_CHECK)
+
+    def start(self):
+        if settings.dailies_prefetch:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "prefetched": self.prefetched}
+
+
+daily_content = DailyContent(mongo, content_pool, host_cache, background_lease)
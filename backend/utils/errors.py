@@ -0,0 +1,17 @@
+#raised when a bounded pool or queue is full, answered with 503 + Retry-After
+class ServiceBusy(Exception):
+    def __init__(self, detail: str, retry_after: int = 1):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+#raised while gemini is failing or the circuit breaker is open
+class LLMUnavailable(ServiceBusy):
+    pass
+
+#raised when a streamed story hasn't reached the part a request needs yet, answered with 409 + Retry-After
+class StoryPartPending(Exception):
+    def __init__(self, detail: str, retry_after: int = 1):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
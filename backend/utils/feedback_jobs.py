@@ -0,0 +1,134 @@
+import asyncio
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from config import settings
+from database import mongo
+from utils.story_helper import generate_final_feedback
+from utils.story_sessions import story_sessions
+from utils.llm_scheduler import set_llm_context, BATCH
+
+#final story feedback runs as a background job against the archived story
+
+
+class FeedbackJobs:
+    def __init__(self, mongo, sessions):
+        self.mongo = mongo
+        self.sessions = sessions
+        self._tasks = set()
+
+    @property
+    def jobs(self):
+        return self.mongo.story_db.feedback_jobs
+
+    async def archive_story(self, story: dict) -> ObjectId:
+        #keep the finished story around for the job instead of deleting it first
+        #one archived copy per started story, a retried or racing completion gets the one already there
+        archived = {key: value for key, value in story.items() if key != "_id"}
+        archived.update({"story_id": story["_id"], "completed": True, "completed_at": datetime.utcnow()})
+        stored = await self.mongo.story_db.completed_stories.find_one_and_update(
+            {"story_id": story["_id"], "session_id": story.get("session_id")},
+            {"$setOnInsert": archived},
+            upsert=True,
+            projection={"_id": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        #only this story leaves active_stories, never one the user has since started on another worker
+        await self.sessions.remove(story)
+        return stored["_id"]
+
+    async def submit(self, story: dict) -> str:
+        archived_id = await self.archive_story(story)
+        result = await self.jobs.update_one(
+            {"story_id": archived_id},
+            {"$setOnInsert": {
+                "user_id": story["user_id"],
+                "status": "pending",
+                "created_at": datetime.utcnow(),
+            }},
+            upsert=True,
+        )
+        if result.upserted_id is not None:
+            self._spawn(result.upserted_id)
+            return str(result.upserted_id)
+        job = await self.jobs.find_one({"story_id": archived_id}, {"_id": 1})
+        return str(job["_id"])
+
+    async def find_completed(self, user_id, transcription: str) -> str:
+        #the job of a story already archived by this very narration, for a retry that finds no active story
+        story = await self.mongo.story_db.completed_stories.find_one(
+            {"user_id": user_id, "parts.4.user_narration.transcription": transcription},
+            {"_id": 1},
+            sort=[("completed_at", -1)],
+        )
+        if story is None:
+            return None
+        job = await self.jobs.find_one({"story_id": story["_id"]}, {"_id": 1})
+        return None if job is None else str(job["_id"])
+
+    def _spawn(self, job_id: ObjectId):
+        task = asyncio.create_task(self._run(job_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _claim(self, job_id: ObjectId) -> dict:
+        #only one worker gets to run a job, a stale claim can be taken over
+        stale = datetime.utcnow() - timedelta(seconds=settings.feedback_job_stale_seconds)
+        return await self.jobs.find_one_and_update(
+            {"_id": job_id, "$or": [
+                {"status": "pending"},
+                {"status": "running", "claimed_at": {"$lt": stale}},
+            ]},
+            {"$set": {"status": "running", "claimed_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _run(self, job_id: ObjectId):
+        #final feedback is polled for, it queues behind interactive generations
+        set_llm_context(BATCH)
+        job = await self._claim(job_id)
+        if job is None:
+            return
+        try:
+            story = await self.mongo.story_db.completed_stories.find_one({"_id": job["story_id"]})
+            final_feedback = await generate_final_feedback(story)
+            await self.jobs.update_one(
+                {"_id": job_id},
+                {"$set": {"status": "done", "final_feedback": final_feedback, "finished_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            print(f"Error generating final feedback for job {job_id}: {e}")
+            await self.jobs.update_one(
+                {"_id": job_id},
+                {"$set": {"status": "failed", "error": str(e), "finished_at": datetime.utcnow()}}
+            )
+
+    async def get(self, job_id: str) -> dict:
+        if not ObjectId.is_valid(job_id):
+            return None
+        job = await self.jobs.find_one({"_id": ObjectId(job_id)})
+        if job is None:
+            return None
+        return {
+            "job_id": job_id,
+            "status": job["status"],
+            "final_feedback": job.get("final_feedback"),
+        }
+
+    async def recover(self):
+        #pick up jobs a restarted worker left behind
+        stale = datetime.utcnow() - timedelta(seconds=settings.feedback_job_stale_seconds)
+        cursor = self.jobs.find(
+            {"$or": [{"status": "pending"}, {"status": "running", "claimed_at": {"$lt": stale}}]},
+            {"_id": 1}
+        )
+        async for job in cursor:
+            self._spawn(job["_id"])
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+feedback_jobs = FeedbackJobs(mongo, story_sessions)
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from config import settings
+
+#cache shared by every worker process on this host: one sqlite file in WAL mode, so readers
+#never block each other or the writer, and entries survive a worker restart
+#it also holds the lease that picks the one worker running the once-per-host background jobs
+HOST_CACHE_PURGE_EVERY = 1000
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS entries (namespace TEXT, key TEXT, value TEXT, expires_at REAL, PRIMARY KEY (namespace, key)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)",
+]
+
+
+def _encode(value) -> str:
+    #datetimes go out the same way fastapi would render them
+    return json.dumps(value, ensure_ascii=False, default=lambda o: o.isoformat() if isinstance(o, datetime) else str(o))
+
+
+class HostCache:
+    def __init__(self, path: str, enabled: bool = True):
+        self.path = path
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._writes = 0
+        self._local = threading.local()
+        #state that lives nowhere else (the content pool) is kept per process when the file is disabled
+        self._memory = {}
+
+    def _connection(self) -> sqlite3.Connection:
+        #one connection per thread and process, a worker forked after preload opens its own
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    def _get(self, namespace: str, key: str):
+        row = self._connection().execute(
+            "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _set(self, namespace: str, key: str, value: str, ttl: float):
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, time.time() + ttl),
+        )
+        self._writes += 1
+        if self._writes % HOST_CACHE_PURGE_EVERY == 0:
+            connection.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+
+    def _delete(self, namespace: str, key: str):
+        self._connection().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def _update(self, namespace: str, key: str, fn, ttl: float):
+        connection = self._connection()
+        #BEGIN IMMEDIATE takes the write lock before reading, so two workers can't both change the old value
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            value, result = fn(self._get(namespace, key))
+            if value is not None:
+                self._set(namespace, key, _encode(value), ttl)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return result
+
+    def _acquire(self, name: str, owner: str, ttl: float) -> bool:
+        #takes a free or lapsed lease, or renews our own, in one statement
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.owner = excluded.owner OR leases.expires_at <= ?",
+            (name, owner, now + ttl, now),
+        )
+        return cursor.rowcount == 1
+
+    def _release(self, name: str, owner: str):
+        self._connection().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    async def get(self, namespace: str, key: str):
+        if not self.enabled:
+            #only what update keeps per process, a disabled cache never holds anything set would store
+            return self._memory.get((namespace, key))
+        try:
+            value = await asyncio.to_thread(self._get, namespace, key)
+        except sqlite3.Error as e:
+            #best effort like the shared mongo tier, a locked or broken file is a miss
+            self.errors += 1
+            print(f"Error reading host cache: {e}")
+            return None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, namespace: str, key: str, value, ttl: float):
+        if not self.enabled or ttl <= 0:
+            return
+        try:
+            await asyncio.to_thread(self._set, namespace, key, _encode(value), ttl)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"Error writing host cache: {e}")
+
+    async def update(self, namespace: str, key: str, fn, ttl: float):
+        #fn(value) -> (new_value, result) runs inside one write transaction, new_value None leaves the entry alone
+        #returns result, or None when the file can't be written
+        if not self.enabled:
+            value, result = fn(self._memory.get((namespace, key)))
+            if value is not None:
+                self._memory[(namespace, key)] = value
+            return result
+        try:
+            return await asyncio.to_thread(self._update, namespace, key, fn, ttl)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"Error updating host cache: {e}")
+            return None
+
+    async def delete(self, namespace: str, key: str):
+        if not self.enabled:
+            self._memory.pop((namespace, key), None)
+            return
+        try:
+            await asyncio.to_thread(self._delete, namespace, key)
+        except sqlite3.Error as e:
+            #the entry still expires with its ttl
+            self.errors += 1
+            print(f"Error deleting from host cache: {e}")
+
+    def stats(self) -> dict:
+        return {"enabled": int(self.enabled), "hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+
+class HostLease:
+    #held by one worker per host at a time, renewed every third of its ttl so a dead holder is replaced within ttl
+    def __init__(self, cache: HostCache, name: str, ttl: float):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self.owner = None
+        self.held = False
+        self._task = None
+
+    async def _renew(self):
+        try:
+            self.held = await asyncio.to_thread(self.cache._acquire, self.name, self.owner, self.ttl)
+        except sqlite3.Error as e:
+            print(f"Error renewing host lease {self.name}: {e}")
+            self.held = False
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await self._renew()
+
+    async def start(self):
+        if not self.cache.enabled:
+            #without the shared file every worker is on its own, as with a single process
+            self.held = True
+            return
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        await self._renew()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.held and self.owner:
+            #hand over right away instead of making the next worker wait out the ttl
+            try:
+                await asyncio.to_thread(self.cache._release, self.name, self.owner)
+            except sqlite3.Error as e:
+                print(f"Error releasing host lease {self.name}: {e}")
+        self.held = False
+
+    def stats(self) -> dict:
+        return {"held": int(self.held)}
+
+
+host_cache = HostCache(settings.host_cache_path, settings.host_cache_enabled)
+background_lease = HostLease(host_cache, "background", settings.host_lease_ttl)
@@ -0,0 +1,106 @@
+import asyncio
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from database import mongo
+from utils.all_helper import SUPPORTED_LANGUAGES
+from utils.leaderboard import score_field, leaderboard_index_name
+
+#every index the app relies on, as (database, collection, keys, options)
+INDEX_SPECS = [
+    ("auth_db", "users", [("username", ASCENDING)], {"name": "username_1", "unique": True}),
+    #unique, so two concurrent story starts can't both insert an active story for the user
+    ("story_db", "active_stories", [("user_id", ASCENDING)], {"name": "user_id_1", "unique": True}),
+    ("story_db", "feedback_jobs", [("status", ASCENDING)], {"name": "status_1"}),
+    #one job per archived story, a retried completion finds it instead of queueing another
+    ("story_db", "feedback_jobs", [("story_id", ASCENDING)], {"name": "story_id_1", "unique": True}),
+    #one archived copy per started story, stories from before session ids are left out
+    ("story_db", "completed_stories", [("story_id", ASCENDING), ("session_id", ASCENDING)], {"name": "story_id_1_session_id_1", "unique": True, "partialFilterExpression": {"session_id": {"$type": "objectId"}}}),
+    ("story_db", "completed_stories", [("user_id", ASCENDING), ("completed_at", DESCENDING)], {"name": "user_id_1_completed_at_-1"}),
+    ("story_db", "story_library", [("language", ASCENDING), ("level", ASCENDING), ("title_key", ASCENDING)], {"name": "language_1_level_1_title_key_1", "unique": True}),
+    ("story_db", "story_library", [("language", ASCENDING), ("level", ASCENDING), ("served", ASCENDING)], {"name": "language_1_level_1_served_1"}),
+    ("story_db", "story_seen", [("user_id", ASCENDING), ("story_id", ASCENDING)], {"name": "user_id_1_story_id_1", "unique": True}),
+    ("story_db", "story_seen", [("user_id", ASCENDING), ("language", ASCENDING), ("level", ASCENDING)], {"name": "user_id_1_language_1_level_1"}),
+    ("cache_db", "teacher_responses", [("expires_at", ASCENDING)], {"name": "expires_at_1", "expireAfterSeconds": 0}),
+    ("cache_db", "user_dailies", [("expires_at", ASCENDING)], {"name": "expires_at_1", "expireAfterSeconds": 0}),
+    ("cache_db", "user_dailies", [("day", ASCENDING)], {"name": "day_1"}),
+] + [
+    ("auth_db", "users", [(score_field(language), DESCENDING), ("username", ASCENDING)], {"name": leaderboard_index_name(language)})
+    for language in SUPPORTED_LANGUAGES
+]
+
+
+class IndexManager:
+    def __init__(self, mongo, specs: list):
+        self.mongo = mongo
+        self.specs = specs
+        self.results = {}
+        self._task = None
+
+    async def _ensure(self, db_name: str, collection: str, keys: list, options: dict):
+        name = options["name"]
+        self.results[(db_name, collection, name)] = {"status": "building"}
+        try:
+            #create_index is a no-op when an identical index already exists
+            try:
+                await self.mongo.client[db_name][collection].create_index(keys, **options)
+            except OperationFailure as e:
+                #IndexOptionsConflict / IndexKeySpecsConflict: an older definition under the same name
+                if e.code not in (85, 86):
+                    raise
+                print(f"Rebuilding index {db_name}.{collection}.{name} with its new options")
+                await self.mongo.client[db_name][collection].drop_index(name)
+                await self.mongo.client[db_name][collection].create_index(keys, **options)
+            self.results[(db_name, collection, name)] = {"status": "ready"}
+        except Exception as e:
+            print(f"Error creating index {db_name}.{collection}.{name}: {e}")
+            self.results[(db_name, collection, name)] = {"status": "error", "error": str(e)}
+
+    async def ensure_all(self):
+        await asyncio.gather(*(self._ensure(*spec) for spec in self.specs))
+
+    def start(self):
+        #builds on a large collection can take a while, so they run beside startup instead of blocking it
+        self._task = asyncio.create_task(self.ensure_all())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _builds_in_progress(self) -> list:
+        try:
+            result = await self.mongo.client.admin.command({
+                "currentOp": True,
+                "$or": [
+                    {"command.createIndexes": {"$exists": True}},
+                    {"msg": {"$regex": "^Index Build"}},
+                ],
+            })
+        except Exception:
+            #currentOp needs extra privileges on shared clusters
+            return []
+        return [
+            {"namespace": op.get("ns"), "progress": op.get("progress"), "message": op.get("msg")}
+            for op in result.get("inprog", [])
+        ]
+
+    async def status(self) -> dict:
+        indexes = []
+        for db_name, collection, keys, options in self.specs:
+            result = self.results.get((db_name, collection, options["name"]), {"status": "pending"})
+            indexes.append({
+                "collection": f"{db_name}.{collection}",
+                "name": options["name"],
+                **result,
+            })
+        return {
+            "indexes": indexes,
+            "builds_in_progress": await self._builds_in_progress(),
+        }
+
+
+index_manager = IndexManager(mongo, INDEX_SPECS)
@@ -0,0 +1,167 @@
+import json
+
+#incremental json parsing for streamed llm output
+
+
+def strip_trailing_commas(text: str) -> str:
+    #gemini copies the trailing commas from our prompt templates, json.loads rejects them
+    out = []
+    in_string = False
+    escape = False
+    pending_comma = None
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if pending_comma is not None:
+            if ch.isspace():
+                pending_comma += ch
+                continue
+            if ch not in '}]':
+                out.append(pending_comma)
+            else:
+                out.append(pending_comma[1:])
+            pending_comma = None
+        if ch == ',':
+            pending_comma = ch
+            continue
+        if ch == '"':
+            in_string = True
+        out.append(ch)
+    if pending_comma is not None:
+        out.append(pending_comma)
+    return ''.join(out)
+
+
+def loads_tolerant(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(strip_trailing_commas(text))
+
+
+class IncrementalJSONParser:
+    #feed() text as it streams in and get back (path, value) for every value that
+    #completes at 1 <= len(path) <= max_depth, e.g. ("title",) or ("parts", 0)
+    def __init__(self, max_depth: int = 2):
+        self.max_depth = max_depth
+        self.buffer = ""
+        self.pos = 0
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.token_start = None
+        self.root_start = None
+        self.root_end = None
+        self.root_fields = 0
+
+    @property
+    def done(self) -> bool:
+        return self.root_end is not None
+
+    @property
+    def value(self):
+        if not self.done:
+            raise ValueError("JSON document is incomplete")
+        return loads_tolerant(self.buffer[self.root_start:self.root_end])
+
+    def _child_path(self) -> tuple:
+        frame = self.stack[-1]
+        if frame["type"] == "object":
+            return frame["path"] + (frame["key"],)
+        return frame["path"] + (frame["index"],)
+
+    def _complete(self, path: tuple, start: int, end: int, events: list):
+        if 1 <= len(path) <= self.max_depth:
+            try:
+                value = loads_tolerant(self.buffer[start:end])
+            except ValueError:
+                #a malformed value (8/10, 'quoted') is left out, schema validation then names it as missing
+                return
+            events.append((path, value))
+            if len(path) == 1 and isinstance(path[0], str):
+                self.root_fields += 1
+
+    def _close_root(self, end: int):
+        try:
+            loads_tolerant(self.buffer[self.root_start:end])
+        except ValueError:
+            if not self.root_fields:
+                #brackets in chatter before the document, as in "here is [the] json", keep looking
+                self.root_start = None
+                return
+        #a broken document that still gave us fields ends here, its fields are what we have
+        self.root_end = end
+
+    def _end_primitive(self, end: int, events: list):
+        if self.token_start is not None:
+            self._complete(self._child_path(), self.token_start, end, events)
+            self.token_start = None
+
+    def feed(self, chunk: str) -> list:
+        self.buffer += chunk
+        events = []
+        while self.pos < len(self.buffer) and not self.done:
+            i = self.pos
+            ch = self.buffer[i]
+            self.pos += 1
+
+            if self.root_start is None:
+                #skip markdown fences or chatter before the document starts
+                if ch in '{[':
+                    self.root_start = i
+                    self.stack.append({"type": "object" if ch == '{' else "array", "path": (), "start": i,
+                                       "key": None, "index": 0, "expect_key": ch == '{'})
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    frame = self.stack[-1]
+                    if frame["type"] == "object" and frame["expect_key"]:
+                        try:
+                            frame["key"] = json.loads(self.buffer[self.token_start:i + 1])
+                        except ValueError:
+                            frame["key"] = None
+                    else:
+                        self._complete(self._child_path(), self.token_start, i + 1, events)
+                    self.token_start = None
+                continue
+
+            if ch == '"':
+                self.in_string = True
+                self.token_start = i
+            elif ch in '{[':
+                self.stack.append({"type": "object" if ch == '{' else "array", "path": self._child_path(),
+                                   "start": i, "key": None, "index": 0, "expect_key": ch == '{'})
+            elif ch in '}]':
+                self._end_primitive(i, events)
+                frame = self.stack.pop()
+                if not self.stack:
+                    self._close_root(i + 1)
+                else:
+                    self._complete(frame["path"], frame["start"], i + 1, events)
+            elif ch == ',':
+                self._end_primitive(i, events)
+                frame = self.stack[-1]
+                if frame["type"] == "object":
+                    frame["expect_key"] = True
+                else:
+                    frame["index"] += 1
+            elif ch == ':':
+                self.stack[-1]["expect_key"] = False
+            elif ch.isspace():
+                self._end_primitive(i, events)
+            elif self.token_start is None:
+                self.token_start = i
+        return events
@@ -0,0 +1,181 @@
+import asyncio
+import base64
+import json
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING
+from config import settings
+from utils.all_helper import SUPPORTED_LANGUAGES
+from utils.host_cache import host_cache
+
+#leaderboard reads walk the (languages.<LANG> desc, username asc) index page by page
+#the materialized leaderboard_<LANG> collections are rebuilt every settings.leaderboard_snapshot_interval seconds, 0 reads live
+LEADERBOARD_MAX_PAGE_SIZE = 500
+#how long a worker trusts the host cached refreshed_at before asking mongo again
+LEADERBOARD_META_TTL = 5
+
+
+def score_field(language: str) -> str:
+    return f"languages.{language}"
+
+def leaderboard_index_name(language: str) -> str:
+    return f"leaderboard_{language}"
+
+def snapshot_collection_name(language: str) -> str:
+    return f"leaderboard_{language}"
+
+def encode_cursor(points: int, username: str, rank: int) -> str:
+    raw = json.dumps([points, username, rank]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        points, username, rank = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid leaderboard cursor")
+    return points, username, rank
+
+def _after(language: str, points: int, username: str) -> dict:
+    #everything that sorts after (points, username) in leaderboard order
+    field = score_field(language)
+    return {"$or": [
+        {field: {"$lt": points}},
+        {field: points, "username": {"$gt": username}},
+    ]}
+
+def _ahead(language: str, points: int, username: str = None) -> dict:
+    field = score_field(language)
+    if username is None:
+        return {field: {"$gt": points}}
+    return {"$or": [
+        {field: {"$gt": points}},
+        {field: points, "username": {"$lt": username}},
+    ]}
+
+async def _live_page(users_collection, language: str, limit: int, cursor: str = None) -> dict:
+    field = score_field(language)
+    if cursor:
+        points, username, rank = decode_cursor(cursor)
+        query = _after(language, points, username)
+        start_rank = rank + 1
+    else:
+        query = {field: {"$exists": True}}
+        start_rank = 1
+
+    docs = users_collection.find(query, {"_id": 0, "username": 1, field: 1}) \
+        .sort([(field, DESCENDING), ("username", ASCENDING)]) \
+        .limit(limit + 1)
+
+    rows = []
+    async for doc in docs:
+        rows.append({
+            "username": doc["username"],
+            "points": doc["languages"][language],
+            "rank": start_rank + len(rows),
+        })
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["points"], rows[-1]["username"], rows[-1]["rank"])
+    return {"leaderboard": rows, "next_cursor": next_cursor, "refreshed_at": None}
+
+async def _snapshot_page(db, language: str, limit: int, cursor: str = None, refreshed_at: datetime = None) -> dict:
+    #snapshot rows are keyed by rank, so a page is one range scan on _id
+    after_rank = decode_cursor(cursor)[2] if cursor else 0
+    docs = db[snapshot_collection_name(language)].find({"_id": {"$gt": after_rank}}) \
+        .sort("_id", ASCENDING) \
+        .limit(limit + 1)
+    rows = [{"username": doc["username"], "points": doc["points"], "rank": doc["_id"]} async for doc in docs]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["points"], rows[-1]["username"], rows[-1]["rank"])
+    return {"leaderboard": rows, "next_cursor": next_cursor, "refreshed_at": refreshed_at}
+
+async def _snapshot_refreshed_at(db, language: str) -> str:
+    refreshed_at = await host_cache.get("leaderboard_meta", language)
+    if refreshed_at is None:
+        meta = await db["leaderboard_meta"].find_one({"_id": language})
+        if meta is None:
+            return None
+        refreshed_at = meta["refreshed_at"].isoformat()
+        await host_cache.set("leaderboard_meta", language, refreshed_at, LEADERBOARD_META_TTL)
+    return refreshed_at
+
+async def leaderboard_page(db, language: str, limit: int = None, cursor: str = None) -> dict:
+    limit = max(1, min(limit or settings.leaderboard_page_size, LEADERBOARD_MAX_PAGE_SIZE))
+    refreshed_at = None
+    if settings.leaderboard_snapshot_interval > 0:
+        refreshed_at = await _snapshot_refreshed_at(db, language)
+    if refreshed_at is None:
+        return await _live_page(db["users"], language, limit, cursor)
+    #a snapshot never changes once built, so its pages are cached per host until the next rebuild replaces them
+    key = f"{language}|{refreshed_at}|{limit}|{cursor or ''}"
+    page = await host_cache.get("leaderboard_pages", key)
+    if page is None:
+        page = await _snapshot_page(db, language, limit, cursor, refreshed_at)
+        await host_cache.set("leaderboard_pages", key, page, 2 * settings.leaderboard_snapshot_interval)
+    return page
+
+async def user_rank(users_collection, language: str, username: str) -> dict:
+    field = score_field(language)
+    user = await users_collection.find_one({"username": username}, {"_id": 0, field: 1})
+    if user is None:
+        return None
+    points = user.get("languages", {}).get(language, 0)
+    #indexed count of everyone ahead in leaderboard order, same tie break as the pages
+    rank = await users_collection.count_documents(_ahead(language, points, username)) + 1
+    return {"username": username, "points": points, "rank": rank}
+
+async def refresh_snapshot(db, language: str):
+    field = score_field(language)
+    pipeline = [
+        {"$match": {field: {"$exists": True}}},
+        {"$sort": {field: -1, "username": 1}},
+        {"$setWindowFields": {
+            "sortBy": {field: -1, "username": 1},
+            "output": {"rank": {"$documentNumber": {}}}
+        }},
+        {"$project": {"_id": "$rank", "username": 1, "points": f"${field}"}},
+        #$out swaps the collection in atomically, readers never see a half built board
+        {"$out": snapshot_collection_name(language)}
+    ]
+    await db["users"].aggregate(pipeline, allowDiskUse=True).to_list(None)
+    await db["leaderboard_meta"].update_one(
+        {"_id": language},
+        {"$set": {"refreshed_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+class LeaderboardSnapshotter:
+    def __init__(self, mongo, interval: int, lease):
+        self.mongo = mongo
+        self.interval = interval
+        self.lease = lease
+        self._task = None
+
+    async def refresh_all(self):
+        for language in SUPPORTED_LANGUAGES:
+            try:
+                await refresh_snapshot(self.mongo.auth_db, language)
+            except Exception as e:
+                print(f"Error refreshing {language} leaderboard snapshot: {e}")
+
+    async def _run(self):
+        while True:
+            #one rebuild per host per interval, not one per worker
+            if self.lease.held:
+                await self.refresh_all()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
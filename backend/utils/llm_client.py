@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import time
+from config import settings
+from utils.errors import LLMUnavailable
+from utils.llm_scheduler import llm_scheduler
+from utils.metrics import (
+    LLM_CALL_SECONDS, LLM_QUEUE_SECONDS, LLM_PROMPT_CHARS, LLM_RESPONSE_CHARS,
+    current_llm_helper, record_span,
+)
+from utils.llm_resilience import backoff_delay, llm_breaker, llm_latency, transient_errors
+
+#shared async gemini client, every helper goes through generate_text
+_model = None
+
+
+def get_model():
+    #google.generativeai is slow to import, so the client is built on first use instead of at import
+    global _model
+    if _model is None:
+        import google.generativeai as genai
+        genai.configure(api_key=settings.google_api_key)
+        _model = genai.GenerativeModel(settings.llm_model)
+    return _model
+
+
+def set_model(model):
+    #swaps gemini for a stand-in, used by the benchmarks
+    global _model
+    _model = model
+
+
+class SingleFlight:
+    #concurrent callers with the same key share one in-flight call instead of each making their own
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, fn):
+        future = self._calls.get(key)
+        if future is None:
+            self.leaders += 1
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.followers += 1
+        #shielded so one caller disconnecting doesn't cancel the call for everyone else
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "followers": self.followers}
+
+
+single_flight = SingleFlight()
+
+
+async def _call_once(prompt: str) -> str:
+    helper = current_llm_helper()
+    queued = time.monotonic()
+    async with llm_scheduler.slot(prompt):
+        started = time.monotonic()
+        LLM_QUEUE_SECONDS.labels(helper).observe(started - queued)
+        record_span("llm_queue", started - queued)
+        outcome = "error"
+        try:
+            #generate_content_async keeps the event loop free while gemini is working
+            response = await asyncio.wait_for(get_model().generate_content_async(prompt), timeout=settings.llm_call_timeout)
+            text = response.text
+            outcome = "ok"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            LLM_CALL_SECONDS.labels(helper, outcome).observe(elapsed)
+            record_span("llm_call", elapsed)
+    llm_latency.record(elapsed)
+    LLM_PROMPT_CHARS.labels(helper).inc(len(prompt))
+    LLM_RESPONSE_CHARS.labels(helper).inc(len(text))
+    return text
+
+
+async def _hedged(prompt: str) -> str:
+    #past the p95 latency a second identical call is raced against the first, unless calls are already queueing
+    delay = llm_latency.percentile(0.95) if settings.llm_hedge else None
+    if delay is None:
+        return await _call_once(prompt)
+    tasks = {asyncio.create_task(_call_once(prompt))}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and not llm_scheduler.queued:
+            llm_latency.hedged += 1
+            tasks.add(asyncio.create_task(_call_once(prompt)))
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _generate(prompt: str) -> str:
+    is_probe = llm_breaker.before_call()
+    try:
+        for attempt in range(settings.llm_retries + 1):
+            try:
+                text = await _hedged(prompt)
+            except transient_errors() as e:
+                llm_breaker.record_failure()
+                if attempt == settings.llm_retries or not llm_breaker.allows():
+                    raise LLMUnavailable("Language model is temporarily unavailable", retry_after=5) from e
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            llm_breaker.record_success()
+            return text
+    finally:
+        if is_probe and llm_breaker.probing:
+            llm_breaker.abandon_probe()
+
+
+async def generate_text(prompt: str, share: bool = True) -> str:
+    #share=False for prompts whose answer must be unique to the caller
+    if not share:
+        return await _generate(prompt)
+    key = hashlib.sha256(prompt.encode()).hexdigest()
+    return await single_flight.do(key, lambda: _generate(prompt))
+
+
+def _stream_succeeded(helper: str, prompt: str, started: float, received: int):
+    LLM_CALL_SECONDS.labels(helper, "ok").observe(time.monotonic() - started)
+    LLM_PROMPT_CHARS.labels(helper).inc(len(prompt))
+    LLM_RESPONSE_CHARS.labels(helper).inc(received)
+    llm_breaker.record_success()
+
+
+async def stream_text(prompt: str):
+    #yields text chunks as gemini produces them, holding one slot for the whole stream.
+    #retried only while nothing has been yielded yet, every chunk has to arrive within the deadline
+    helper = current_llm_helper()
+    is_probe = llm_breaker.before_call()
+    try:
+        for attempt in range(settings.llm_retries + 1):
+            yielded = False
+            received = 0
+            try:
+                async with llm_scheduler.slot(prompt):
+                    started = time.monotonic()
+                    response = await asyncio.wait_for(get_model().generate_content_async(prompt, stream=True), timeout=settings.llm_call_timeout)
+                    chunks = response.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), timeout=settings.llm_call_timeout)
+                        except StopAsyncIteration:
+                            break
+                        yielded = True
+                        received += len(chunk.text)
+                        yield chunk.text
+            except transient_errors() as e:
+                LLM_CALL_SECONDS.labels(helper, "error").observe(time.monotonic() - started)
+                llm_breaker.record_failure()
+                if yielded or attempt == settings.llm_retries or not llm_breaker.allows():
+                    raise LLMUnavailable("Language model is temporarily unavailable", retry_after=5) from e
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            except GeneratorExit:
+                #the caller stopped reading, e.g. once the JSON document closed; what it got came through fine
+                if yielded:
+                    _stream_succeeded(helper, prompt, started, received)
+                raise
+            _stream_succeeded(helper, prompt, started, received)
+            return
+    finally:
+        if is_probe and llm_breaker.probing:
+            llm_breaker.abandon_probe()
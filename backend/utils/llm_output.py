@@ -0,0 +1,100 @@
+from contextlib import aclosing
+from pydantic import ValidationError
+from config import settings
+from utils.json_stream import IncrementalJSONParser
+from utils.llm_client import generate_text, stream_text
+from utils.metrics import LLM_PARSE_FAILURES, llm_helper
+
+#one pipeline for every structured gemini answer: tolerant parse, schema check, targeted repair
+
+
+class StructuredOutputError(ValueError):
+    pass
+
+
+class StructuredOutput:
+    #collects top level fields as they complete, so a truncated answer still keeps what it got
+    def __init__(self):
+        self.parser = IncrementalJSONParser(max_depth=1)
+        self.fields = {}
+
+    def feed(self, chunk: str):
+        for path, value in self.parser.feed(chunk):
+            if isinstance(path[0], str):
+                self.fields[path[0]] = value
+
+    @property
+    def done(self) -> bool:
+        return self.parser.done
+
+    def result(self):
+        #None when nothing in the answer parsed at all
+        if self.parser.done:
+            try:
+                return self.parser.value
+            except ValueError:
+                pass
+        return self.fields or None
+
+
+def _failed_fields(schema: type, data, error: ValidationError) -> list:
+    if not isinstance(data, dict):
+        return list(schema.model_fields)
+    fields = []
+    for err in error.errors():
+        field = err["loc"][0] if err["loc"] else None
+        if field not in schema.model_fields:
+            return list(schema.model_fields)
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+
+def _repair_prompt(prompt: str, fields: list, error: ValidationError) -> str:
+    problems = "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in error.errors()[:10])
+    return f"""{prompt}
+
+    Your previous answer had missing or invalid values for: {", ".join(fields)} ({problems}).
+    Return only a JSON object with just these keys: {", ".join(fields)}, following the structure above."""
+
+
+async def _collect(prompt: str, stream: bool, share: bool):
+    output = StructuredOutput()
+    if stream:
+        async with aclosing(stream_text(prompt)) as chunks:
+            async for chunk in chunks:
+                output.feed(chunk)
+                if output.done:
+                    #the document is closed, anything after it is chatter we don't need
+                    break
+    else:
+        output.feed(await generate_text(prompt, share=share))
+    return output.result()
+
+
+async def generate_structured(prompt: str, schema: type, stream: bool = False, share: bool = True) -> dict:
+    with llm_helper(schema.__name__):
+        data = await _collect(prompt, stream, share)
+        for attempt in range(settings.llm_repair_attempts + 1):
+            if data is None:
+                error = "no JSON document in the answer"
+            else:
+                try:
+                    return schema.model_validate(data).model_dump()
+                except ValidationError as e:
+                    error = e
+            if attempt == settings.llm_repair_attempts:
+                LLM_PARSE_FAILURES.labels(schema.__name__, "failed").inc()
+                raise StructuredOutputError(f"Invalid {schema.__name__} from model: {error}")
+            LLM_PARSE_FAILURES.labels(schema.__name__, "repair").inc()
+            if data is None:
+                #nothing to keep, ask the whole question again, uncoalesced so it isn't the same answer
+                data = await _collect(prompt, stream, share=False)
+                continue
+            #ask again only for the fields that failed and keep the ones that validated
+            fields = _failed_fields(schema, data, error)
+            repaired = await _collect(_repair_prompt(prompt, fields, error), stream, share)
+            if not isinstance(data, dict):
+                data = {}
+            if isinstance(repaired, dict):
+                data.update({field: repaired[field] for field in fields if field in repaired})
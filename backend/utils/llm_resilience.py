@@ -0,0 +1,113 @@
+import asyncio
+import random
+import time
+from collections import deque
+from functools import lru_cache
+from config import settings
+from utils.errors import LLMUnavailable
+
+#deadlines, retries, hedging and a circuit breaker around every gemini call
+
+
+@lru_cache(maxsize=None)
+def transient_errors() -> tuple:
+    #resolved on the first failure, google.api_core pulls in grpc and isn't needed to boot
+    try:
+        from google.api_core import exceptions as google_exceptions
+    except ImportError:
+        return (asyncio.TimeoutError,)
+    return (
+        asyncio.TimeoutError,
+        google_exceptions.TooManyRequests,
+        google_exceptions.InternalServerError,
+        google_exceptions.BadGateway,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.GatewayTimeout,
+        google_exceptions.DeadlineExceeded,
+    )
+
+
+def backoff_delay(attempt: int) -> float:
+    #full jitter, so workers retrying the same outage don't come back in lockstep
+    return random.uniform(0, settings.llm_retry_base_delay * 2 ** attempt)
+
+
+class LatencyTracker:
+    #rolling window of successful call durations, drives the hedge delay
+    def __init__(self, window: int = 500):
+        self.samples = deque(maxlen=window)
+        self.hedged = 0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        if len(self.samples) < settings.llm_hedge_min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> dict:
+        p95 = self.percentile(0.95)
+        return {"samples": len(self.samples), "p95_seconds": round(p95, 3) if p95 is not None else None, "hedged": self.hedged}
+
+
+class CircuitBreaker:
+    #closed -> open after consecutive failures, half open after the reset period lets one probe through
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_after: float):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at < self.reset_after:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allows(self) -> bool:
+        state = self.state
+        return state == self.CLOSED or (state == self.HALF_OPEN and not self.probing)
+
+    def before_call(self) -> bool:
+        #returns True when the caller is the half open probe
+        state = self.state
+        if state == self.CLOSED:
+            return False
+        if state == self.HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        self.rejected += 1
+        retry_after = max(1, int(self.reset_after - (time.monotonic() - self.opened_at)))
+        raise LLMUnavailable("Language model is temporarily unavailable", retry_after=retry_after)
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def abandon_probe(self):
+        #the probe was cancelled before it told us anything, let the next caller probe
+        self.probing = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "rejected": self.rejected}
+
+
+llm_breaker = CircuitBreaker(settings.llm_breaker_failures, settings.llm_breaker_reset)
+llm_latency = LatencyTracker()
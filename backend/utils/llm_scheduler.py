@@ -0,0 +1,153 @@
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from config import settings
+from utils.errors import ServiceBusy
+
+#admission control for gemini: global concurrency, tokens-per-minute budget,
+#priority classes and round robin between users inside a class
+INTERACTIVE = 0
+BATCH = 1
+PREFETCH = 2
+
+LLM_QUEUE_DEADLINES = {
+    INTERACTIVE: settings.llm_queue_deadline_interactive,
+    BATCH: settings.llm_queue_deadline_batch,
+    PREFETCH: settings.llm_queue_deadline_prefetch,
+}
+
+_llm_priority = contextvars.ContextVar('llm_priority', default=BATCH)
+_llm_user = contextvars.ContextVar('llm_user', default=None)
+
+
+def set_llm_context(priority: int, user: str = None):
+    #called at the top of an endpoint or background worker, applies to every llm call it makes
+    _llm_priority.set(priority)
+    _llm_user.set(user)
+
+
+def estimate_tokens(prompt: str) -> int:
+    return len(prompt) // 4 + settings.llm_expected_output_tokens
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: int) -> float:
+        #returns 0 when the tokens were taken, otherwise seconds until they will be there
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0
+        return (amount - self.tokens) / self.rate
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int, tokens_per_minute: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.bucket = TokenBucket(tokens_per_minute)
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self.expired = 0
+        self._queues = {priority: OrderedDict() for priority in (INTERACTIVE, BATCH, PREFETCH)}
+        self._timer = None
+
+    def _next_waiter(self):
+        for users in self._queues.values():
+            while users:
+                user, waiters = next(iter(users.items()))
+                #round robin: the user goes to the back of its class after each grant
+                users.move_to_end(user)
+                while waiters and waiters[0][0].done():
+                    waiters.popleft()
+                if not waiters:
+                    del users[user]
+                    continue
+                return waiters, users, user
+        return None
+
+    def _dispatch(self):
+        self._timer = None
+        while self.active < self.max_concurrency:
+            found = self._next_waiter()
+            if found is None:
+                return
+            waiters, users, user = found
+            future, tokens = waiters[0]
+            wait = self.bucket.take(tokens)
+            if wait:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            waiters.popleft()
+            if not waiters:
+                del users[user]
+            self.queued -= 1
+            self.active += 1
+            future.set_result(None)
+
+    async def acquire(self, tokens: int):
+        priority = _llm_priority.get()
+        if self.active < self.max_concurrency and self.queued == 0 and not self.bucket.take(tokens):
+            self.active += 1
+            return
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise ServiceBusy("Too many generations queued, try again shortly", retry_after=5)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(_llm_user.get(), deque()).append((future, tokens))
+        self.queued += 1
+        if self._timer is None:
+            self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=LLM_QUEUE_DEADLINES[priority])
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                #granted right as we gave up, hand the slot back
+                self.release()
+            else:
+                future.cancel()
+                self.queued -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                self.expired += 1
+                raise ServiceBusy("Timed out waiting for a generation slot", retry_after=10)
+            raise
+
+    def release(self):
+        self.active -= 1
+        if self._timer is None:
+            self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, prompt: str):
+        await self.acquire(estimate_tokens(prompt))
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "tokens_available": int(self.bucket.tokens),
+        }
+
+
+llm_scheduler = LLMScheduler(settings.llm_max_concurrency, settings.llm_tokens_per_minute, settings.llm_max_queue)
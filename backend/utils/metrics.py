@@ -0,0 +1,161 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+from pymongo import monitoring
+from config import settings
+
+#prometheus metrics for routes, gemini and mongo, plus opt-in per request span timings
+TRACE_HEADER = 'x-trace'
+
+registry = CollectorRegistry()
+
+REQUEST_SECONDS = Histogram(
+    'langstar_request_seconds', 'Request latency by route',
+    ['method', 'route', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    registry=registry,
+)
+LLM_CALL_SECONDS = Histogram(
+    'langstar_llm_call_seconds', 'Gemini call latency by helper, excluding time queued for a slot',
+    ['helper', 'outcome'],
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+    registry=registry,
+)
+LLM_QUEUE_SECONDS = Histogram(
+    'langstar_llm_queue_seconds', 'Time spent waiting for a Gemini slot',
+    ['helper'],
+    buckets=(0.001, 0.01, 0.1, 0.5, 1, 5, 10, 30, 60),
+    registry=registry,
+)
+LLM_PROMPT_CHARS = Counter('langstar_llm_prompt_chars', 'Characters sent to Gemini', ['helper'], registry=registry)
+LLM_RESPONSE_CHARS = Counter('langstar_llm_response_chars', 'Characters received from Gemini', ['helper'], registry=registry)
+LLM_PARSE_FAILURES = Counter(
+    'langstar_llm_parse_failures', 'Structured answers that failed validation, by whether a repair was attempted',
+    ['helper', 'result'],
+    registry=registry,
+)
+MONGO_COMMAND_SECONDS = Histogram(
+    'langstar_mongo_command_seconds', 'Mongo command latency by collection',
+    ['database', 'collection', 'command', 'outcome'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+    registry=registry,
+)
+
+_llm_helper = contextvars.ContextVar('llm_helper', default='other')
+_trace = contextvars.ContextVar('trace', default=None)
+
+
+@contextmanager
+def llm_helper(name: str):
+    #labels every gemini call made inside the block
+    token = _llm_helper.set(name)
+    try:
+        yield
+    finally:
+        _llm_helper.reset(token)
+
+
+def current_llm_helper() -> str:
+    return _llm_helper.get()
+
+
+#span tracing, only collected for requests that ask for it
+def start_trace(request) -> dict:
+    if not settings.trace_requests and TRACE_HEADER not in request.headers:
+        return None
+    spans = {}
+    _trace.set(spans)
+    return spans
+
+
+def record_span(name: str, seconds: float):
+    spans = _trace.get()
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name: str):
+    if _trace.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def server_timing(spans: dict, total: float) -> str:
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    #succeeded/failed events don't carry the collection, so it is remembered from the started event
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else ''
+        self._collections[(event.connection_id, event.request_id)] = (event.database_name, collection)
+
+    def _observe(self, event, outcome: str):
+        database, collection = self._collections.pop((event.connection_id, event.request_id), ('', ''))
+        MONGO_COMMAND_SECONDS.labels(database, collection, event.command_name, outcome).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._observe(event, 'ok')
+
+    def failed(self, event):
+        self._observe(event, 'error')
+
+
+class StatsCollector:
+    #exposes the stats() of caches, pools and the llm scheduler as gauges, with hit ratios where they apply
+    def __init__(self):
+        self.sources = {}
+
+    def register(self, name: str, stats):
+        self.sources[name] = stats
+
+    def _flatten(self, stats: dict, prefix: str = ''):
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                yield from self._flatten(value, f"{prefix}{key}_")
+            elif isinstance(value, (int, float)):
+                yield f"{prefix}{key}", float(value)
+
+    def collect(self):
+        gauge = GaugeMetricFamily('langstar_component_stat', 'Counters and sizes reported by caches, pools and schedulers', labels=['component', 'stat'])
+        ratio = GaugeMetricFamily('langstar_component_hit_ratio', 'hits / (hits + misses) since start', labels=['component', 'stat'])
+        for name, stats in self.sources.items():
+            values = dict(self._flatten(stats()))
+            for stat, value in values.items():
+                gauge.add_metric([name, stat], value)
+                if stat.endswith('hits'):
+                    misses = values.get(stat[:-4] + 'misses')
+                    if misses is not None and value + misses:
+                        ratio.add_metric([name, stat[:-4] + 'hit_ratio'], value / (value + misses))
+        yield gauge
+        yield ratio
+
+
+mongo_command_metrics = MongoCommandMetrics()
+component_stats = StatsCollector()
+registry.register(component_stats)
+
+
+def render() -> tuple:
+    if settings.prometheus_multiproc_dir:
+        #under gunicorn a scrape reaches one worker, so it reads back the samples every worker wrote;
+        #component stats are live objects and still come from the worker that answered
+        scrape = CollectorRegistry()
+        multiprocess.MultiProcessCollector(scrape)
+        scrape.register(component_stats)
+        return generate_latest(scrape), CONTENT_TYPE_LATEST
+    return generate_latest(registry), CONTENT_TYPE_LATEST
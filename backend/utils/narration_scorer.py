@@ -0,0 +1,113 @@
+import unicodedata
+from config import settings
+
+#local scoring of a narration against the text it should match, so clear-cut cases skip gemini
+
+
+def _strip_latin_diacritics(text: str) -> str:
+    #speech to text often drops accents on latin letters, but marks on gujarati/telugu
+    #letters are vowel signs and viramas, so only marks on a latin base are removed
+    out = []
+    base_is_latin = False
+    for ch in unicodedata.normalize('NFD', text):
+        if unicodedata.category(ch) == 'Mn':
+            if base_is_latin:
+                continue
+        else:
+            base_is_latin = 'LATIN' in unicodedata.name(ch, '')
+        out.append(ch)
+    return unicodedata.normalize('NFC', ''.join(out))
+
+
+def _katakana_to_hiragana(text: str) -> str:
+    return ''.join(chr(ord(ch) - 0x60) if 'ァ' <= ch <= 'ヶ' else ch for ch in text)
+
+
+def _is_unspaced_script(ch: str) -> bool:
+    #japanese is written without spaces, compare it character by character
+    code = ord(ch)
+    return 0x3040 <= code <= 0x30FF or 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = _strip_latin_diacritics(text)
+    text = _katakana_to_hiragana(text)
+    #punctuation and symbols become word breaks
+    text = ''.join(' ' if unicodedata.category(ch)[0] in 'PSZ' else ch for ch in text)
+    return ' '.join(text.split())
+
+
+def tokenize(text: str) -> list:
+    tokens = []
+    for word in normalize_text(text).split():
+        if any(_is_unspaced_script(ch) for ch in word):
+            tokens.extend(word)
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def edit_distance(reference: list, hypothesis: list) -> int:
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_token in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_token in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_token != hyp_token),
+            ))
+        previous = current
+    return previous[-1]
+
+
+def score_narration(original: str, narration: str) -> dict:
+    reference = tokenize(original)
+    hypothesis = tokenize(narration)
+    distance = edit_distance(reference, hypothesis)
+    accuracy = max(0.0, 1 - distance / max(len(reference), 1)) * 100
+    hypothesis_set = set(hypothesis)
+    return {
+        "accuracy": round(accuracy, 1),
+        "distance": distance,
+        "missed": [token for token in dict.fromkeys(reference) if token not in hypothesis_set],
+    }
+
+
+def local_narration_feedback(original: str, narration: str) -> dict:
+    #NarrationFeedback shaped result for clear-cut cases, None when gemini should judge it
+    score = score_narration(original, narration)
+    accuracy = score["accuracy"]
+    missed = score["missed"][:3]
+    if accuracy >= settings.narration_local_high:
+        return {
+            "accuracy_score": accuracy,
+            "pronunciation_feedback": "Your narration matched the text closely.",
+            "grammar_feedback": "No grammar issues, the sentence structure was kept.",
+            "vocabulary_feedback": "All the key words were used correctly.",
+            "improvement_areas": [f"Practice the word: {token}" for token in missed] or ["Try narrating at a natural speaking pace"],
+            "positive_points": ["Accurate narration", "Complete sentences", "Correct word order"],
+        }
+    if accuracy <= settings.narration_local_low:
+        return {
+            "accuracy_score": accuracy,
+            "pronunciation_feedback": "Most of the narration did not match the text. Read the part again slowly.",
+            "grammar_feedback": "The sentence structure was too different from the original to assess.",
+            "vocabulary_feedback": "Several key words from the text were missing.",
+            "improvement_areas": [f"Practice the word: {token}" for token in missed] or ["Read the text aloud before recording"],
+            "positive_points": ["You attempted the narration"],
+        }
+    return None
+
+
+def local_speech_score(reference: str, transcript: str) -> int:
+    #1-10 speech score against a known reference, None when gemini should judge it
+    if not tokenize(transcript):
+        return 0
+    if not reference:
+        return None
+    accuracy = score_narration(reference, transcript)["accuracy"]
+    if accuracy >= settings.narration_local_high or accuracy <= settings.narration_local_low:
+        return max(1, round(accuracy / 10))
+    return None
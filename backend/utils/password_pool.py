@@ -0,0 +1,47 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from config import settings
+from utils.all_helper import pwd_context
+from utils.errors import ServiceBusy
+
+#bcrypt runs on a small dedicated pool so a login burst can't freeze the event loop
+
+
+class PasswordHasher:
+    def __init__(self, context, workers: int, max_queue: int):
+        self.context = context
+        self.workers = workers
+        self.max_pending = workers + max_queue
+        self.pending = 0
+        self._executor = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            #the bcrypt backend releases the GIL, so threads give real parallelism
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise ServiceBusy("Too many logins in progress, try again shortly")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed: str) -> tuple:
+        #returns (valid, new_hash), new_hash is set when the stored hash uses outdated parameters
+        return await self._run(self.context.verify_and_update, password, hashed)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(pwd_context, settings.password_workers, settings.password_max_queue)
@@ -0,0 +1,134 @@
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from config import settings
+from database import mongo
+from utils.host_cache import host_cache
+
+#tiered cache for llm responses: in-process LRU, then the sqlite file shared by the workers on this host,
+#then a mongo collection shared by every host
+#mongo drops shared entries on its own once expires_at has passed (TTL index in utils/indexes)
+
+
+def normalize_query(text: str) -> str:
+    #case, unicode width, punctuation and whitespace differences should hit the same entry
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = ''.join(ch for ch in text if not unicodedata.category(ch).startswith('P'))
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class TieredCache:
+    def __init__(self, mongo, host, collection_name: str, local_size: int, local_ttl: int, shared_ttl: int):
+        self.mongo = mongo
+        self.host = host
+        self.collection_name = collection_name
+        self.local = LRUCache(local_size, local_ttl)
+        self.shared_ttl = shared_ttl
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    @property
+    def collection(self):
+        return self.mongo.cache_db[self.collection_name]
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        return '|'.join(normalize_query(part) for part in parts)
+
+    async def get(self, key: str):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        value = await self.host.get(self.collection_name, key)
+        if value is not None:
+            self.local.set(key, value)
+            return value
+        try:
+            doc = await self.collection.find_one(
+                {"_id": key, "expires_at": {"$gt": datetime.utcnow()}},
+                {"value": 1},
+            )
+        except Exception as e:
+            #the shared tier is best effort, a mongo hiccup just means a miss
+            print(f"Error reading shared cache: {e}")
+            doc = None
+        if doc is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        self.local.set(key, doc["value"])
+        await self.host.set(self.collection_name, key, doc["value"], self.local.ttl)
+        return doc["value"]
+
+    async def set(self, key: str, value):
+        self.local.set(key, value)
+        await self.host.set(self.collection_name, key, value, self.local.ttl)
+        try:
+            await self.collection.replace_one(
+                {"_id": key},
+                {"value": value, "expires_at": datetime.utcnow() + timedelta(seconds=self.shared_ttl)},
+                upsert=True,
+            )
+        except Exception as e:
+            print(f"Error writing shared cache: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "local": self.local.stats(),
+            "shared": {"hits": self.shared_hits, "misses": self.shared_misses},
+        }
+
+
+teacher_cache = TieredCache(
+    mongo,
+    host_cache,
+    "teacher_responses",
+    local_size=settings.cache_local_size,
+    local_ttl=settings.cache_local_ttl,
+    shared_ttl=settings.cache_shared_ttl,
+)
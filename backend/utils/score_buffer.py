@@ -0,0 +1,163 @@
+import asyncio
+import fcntl
+import glob
+import json
+import os
+import time
+from pymongo import UpdateOne
+from config import settings
+from database import mongo
+
+#write-behind buffer for score increments, combined per (user, language) and flushed in bulk
+
+
+class ScoreJournal:
+    #append-only local journal, every file is flock'ed by the worker that owns it so a
+    #restarted worker can adopt files whose owner died without touching live ones
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.active = None
+        self.sealed = []
+
+    def _lock(self, path: str):
+        f = open(path, "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+        return f
+
+    def _open_new(self):
+        path = os.path.join(self.directory, f"scores-{os.getpid()}-{time.time_ns()}.jsonl")
+        self.active = self._lock(path)
+
+    def open(self) -> list:
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for path in sorted(glob.glob(os.path.join(self.directory, "scores-*.jsonl"))):
+            f = self._lock(path)
+            if f is None:
+                continue
+            f.seek(0)
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    #a torn last line from a crash mid-write
+                    pass
+            self.sealed.append(f)
+        self._open_new()
+        return entries
+
+    def append(self, username: str, language: str, score: int):
+        self.active.write(json.dumps([username, language, score]) + "\n")
+        self.active.flush()
+
+    def seal(self) -> list:
+        #everything journaled so far belongs to the batch being flushed
+        self.sealed.append(self.active)
+        self._open_new()
+        return list(self.sealed)
+
+    def release(self, files: list):
+        for f in files:
+            os.remove(f.name)
+            f.close()
+            self.sealed.remove(f)
+
+    def close(self):
+        if self.active is not None and self.active.tell() == 0:
+            os.remove(self.active.name)
+        for f in self.sealed + [self.active]:
+            if f is not None:
+                f.close()
+        self.sealed = []
+        self.active = None
+
+
+class ScoreBuffer:
+    def __init__(self, mongo, journal: ScoreJournal, interval: float, threshold: int):
+        self.mongo = mongo
+        self.journal = journal
+        self.interval = interval
+        self.threshold = threshold
+        self.pending = {}
+        self.inflight = {}
+        self.flush_errors = 0
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def _merge(self, username: str, language: str, score: int):
+        key = (username, language)
+        self.pending[key] = self.pending.get(key, 0) + score
+
+    def add(self, username: str, language: str, score: int):
+        if not score:
+            return
+        #journal first, the increment is only acknowledged once it is on disk
+        self.journal.append(username, language, score)
+        self._merge(username, language, score)
+        if len(self.pending) >= self.threshold:
+            self._wake.set()
+
+    def pending_for(self, username: str) -> dict:
+        deltas = {}
+        for (user, language), score in list(self.pending.items()) + list(self.inflight.items()):
+            if user == username:
+                deltas[language] = deltas.get(language, 0) + score
+        return deltas
+
+    async def flush(self):
+        async with self._lock:
+            if not self.pending and not self.journal.sealed:
+                return
+            batch, self.pending = self.pending, {}
+            files = self.journal.seal()
+            self.inflight = batch
+            try:
+                if batch:
+                    await self.mongo.users.bulk_write([
+                        UpdateOne({"username": username}, {"$inc": {f"languages.{language}": score}})
+                        for (username, language), score in batch.items()
+                    ], ordered=False)
+            except Exception as e:
+                #keep the batch and its journal files, the next flush retries them
+                print(f"Error flushing score buffer: {e}")
+                self.flush_errors += 1
+                for (username, language), score in batch.items():
+                    self._merge(username, language, score)
+                return
+            finally:
+                self.inflight = {}
+            self.journal.release(files)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def start(self):
+        #replay what a crashed or killed worker journaled but never flushed
+        for username, language, score in self.journal.open():
+            self._merge(username, language, score)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self.journal.close()
+
+
+score_buffer = ScoreBuffer(mongo, ScoreJournal(settings.score_journal_dir), settings.score_flush_interval, settings.score_flush_threshold)
@@ -1,35 +1,17 @@
-from passlib.context import CryptContext
-from jose import JWTError, jwt
-from datetime import datetime, timedelta
-import dotenv
-import os
-from fastapi.security import OAuth2PasswordBearer
-import google.generativeai as genai
-import json
-from pymongo import MongoClient
-from pymongo.server_api import ServerApi
-
-# Database setup
-dotenv.load_dotenv()
-uri = os.getenv('MONGO_URI')
-client = MongoClient(uri, server_api=ServerApi('1'))
-storydb = client["story_db"]
-
-#gemini model
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-model = genai.GenerativeModel('gemini-pro')
-
-# Security configurations
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-SECRET_KEY = os.getenv('SECRET_KEY')
-ALGORITHM = os.getenv('ALGORITHM')
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES'))
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+import asyncio
+from datetime import datetime
+from utils.llm_client import stream_text
+from utils.llm_output import generate_structured
+from basemodels.allpydmodels import GeneratedStory, NarrationFeedback, FinalFeedback, StoryPart
+from utils.json_stream import IncrementalJSONParser
+from utils.narration_scorer import local_narration_feedback
+from utils.metrics import span
+from utils.errors import StoryPartPending
 
 
 #generating stories
-def generate_stories(language: str, level: str) -> dict:
-    prompt = f"""Generate a 5-part story in {language} for {level} level language learners.
+def story_prompt(language: str, level: str) -> str:
+    return f"""Generate a 5-part story in {language} for {level} level language learners.
     Each part should be 2-3 sentences long and simple enough to be illustrated.
     Return only a JSON object with this exact structure:
     {{
@@ -45,50 +27,181 @@ def generate_stories(language: str, level: str) -> dict:
             ... (repeat for all 5 parts)
         ]
     }}"""
-    
-    response = model.generate_content(prompt)
-    cleaned_text = response.text.strip()
-    cleaned_text = cleaned_text.replace('```json\n', '').replace('\n```', '')
-    cleaned_text = ''.join(line.strip() for line in cleaned_text.splitlines())
-    
-    return json.loads(cleaned_text)
 
+async def generate_stories(language: str, level: str) -> dict:
+    prompt = story_prompt(language, level)
+    #the story library needs distinct stories, so identical prompts are not coalesced
+    return await generate_structured(prompt, GeneratedStory, share=False)
 
-async def generate_and_start_story(user_id: str, language: str, level: str) -> dict:
-    story_data = generate_stories(language, level)
-    
-    # Delete all stories in active_stories collection for this user
-    storydb.active_stories.delete_many({"user_id": user_id})
-    
+
+def story_part_doc(part: dict) -> dict:
+    return {
+        "part_number": part["part_number"],
+        "content": part["content"],
+        "translation": part["translation"],
+        "description": part["description"],
+        "user_narration": None
+    }
+
+
+async def activate_story(sessions, user_id: str, language: str, level: str, story_data: dict, library_id=None) -> dict:
     story_doc = {
         "user_id": user_id,
         "language": language,
         "level": level,
+        "library_id": library_id,
         "title": story_data["title"],
         "title_english": story_data["title_english"],
         "created_at": datetime.utcnow(),
         "current_part": 1,
         "completed": False,
-        "parts": [
-            {
-                "part_number": part["part_number"],
-                "content": part["content"],
-                "translation": part["translation"],
-                "description": part["description"],
-                "user_narration": None
-            }
-            for part in story_data["parts"]
-        ]
+        "parts": [story_part_doc(part) for part in story_data["parts"]]
     }
     
-    result = storydb.active_stories.insert_one(story_doc)
+    # Replaces the user's previous active story
+    return await sessions.start(story_doc)
+
+
+async def generate_and_start_story(sessions, library, user_id: str, language: str, level: str) -> dict:
+    #served from the story library when there is a story this user hasn't read yet
+    story_data = await library.take(user_id, language, level)
+    if story_data is None:
+        story_data = await library.generate(user_id, language, level)
+    story_doc = await activate_story(sessions, user_id, language, level, story_data, story_data.get("_id"))
     return {
-        "story_id": str(result.inserted_id),
+        "story_id": str(story_doc["_id"]),
         "current_part": story_doc["parts"][0],
         "total_parts": 5
     }
 
-def evaluate_user_narration(original_text: str, user_narration: str, language: str) -> dict:
+
+#stories being written by _write_story, referenced so a disconnected client's story isn't garbage collected
+_story_writers = set()
+
+
+async def _write_story(sessions, library, user_id: str, language: str, level: str, events: asyncio.Queue):
+    #persists the story part by part while gemini is still writing the rest, and reports on events
+    #runs as its own task, so it carries on when the client that asked for it goes away
+    parser = IncrementalJSONParser(max_depth=2)
+    story = None
+    title = None
+    title_english = None
+    parts_saved = 0
+    captured = []
+    finished = False
+    try:
+        #a library story is already complete, nothing to stream
+        story_data = await library.take(user_id, language, level)
+        if story_data is not None:
+            story_doc = await activate_story(sessions, user_id, language, level, story_data, story_data["_id"])
+            finished = True
+            events.put_nowait({
+                "event": "start",
+                "story_id": str(story_doc["_id"]),
+                "title": story_doc["title"],
+                "title_english": story_doc["title_english"],
+                "current_part": story_doc["parts"][0],
+                "total_parts": 5
+            })
+            events.put_nowait({"event": "done", "story_id": str(story_doc["_id"]), "total_parts": 5})
+            return
+        async for chunk in stream_text(story_prompt(language, level)):
+            for path, value in parser.feed(chunk):
+                if path == ("title",):
+                    title = value
+                elif path == ("title_english",):
+                    title_english = value
+                elif len(path) == 2 and path[0] == "parts":
+                    if parts_saved == 5:
+                        #stories have five parts, extra ones are never narrated
+                        continue
+                    captured.append(StoryPart.model_validate(value).model_dump())
+                    part = story_part_doc(captured[-1])
+                    if story is None:
+                        story = await sessions.start({
+                            "user_id": user_id,
+                            "language": language,
+                            "level": level,
+                            "library_id": None,
+                            "title": title,
+                            "title_english": title_english,
+                            "created_at": datetime.utcnow(),
+                            "current_part": 1,
+                            "completed": False,
+                            "parts": [part]
+                        })
+                        events.put_nowait({
+                            "event": "start",
+                            "story_id": str(story["_id"]),
+                            "title": title,
+                            "title_english": title_english,
+                            "current_part": part,
+                            "total_parts": 5
+                        })
+                    else:
+                        #appended by session, not version, a narration of an earlier part may land meanwhile
+                        story = await sessions.amend(story, {"$push": {"parts": part}})
+                        if story is None:
+                            raise ValueError("Story was replaced while it was being streamed")
+                    parts_saved += 1
+        if story is None or parts_saved < 5:
+            raise ValueError(f"Story stream ended after {parts_saved} parts")
+        try:
+            parsed = GeneratedStory.model_validate(parser.value).model_dump()
+        except ValueError as e:
+            #all five parts are stored already, rebuild the story from what was captured instead of dropping it
+            print(f"Streamed story failed final validation, using the captured parts: {e}")
+            parsed = GeneratedStory.model_validate({
+                "title": title,
+                "title_english": title_english,
+                "parts": captured,
+            }).model_dump()
+        if title is None or title_english is None:
+            #titles written after the parts still need to land on the stored story
+            story = await sessions.amend(
+                story,
+                {"$set": {"title": parsed["title"], "title_english": parsed["title_english"]}}
+            ) or story
+        finished = True
+        events.put_nowait({"event": "done", "story_id": str(story["_id"]), "total_parts": parts_saved})
+        stored = await library.add(language, level, parsed)
+        if stored is not None:
+            await library.mark_seen(user_id, language, level, stored["_id"])
+            await sessions.amend(story, {"$set": {"library_id": stored["_id"]}})
+    except Exception as e:
+        print(f"Error streaming story: {e}")
+        if not finished:
+            events.put_nowait({"event": "error", "detail": "Error generating story"})
+    finally:
+        #also reached when the task is cancelled on shutdown, a half written story would leave
+        #every narration waiting on parts that never come
+        if story is not None and not finished:
+            try:
+                await sessions.remove(story)
+            except Exception as e:
+                print(f"Error removing unfinished story: {e}")
+        events.put_nowait(None)
+
+
+async def stream_and_start_story(sessions, library, user_id: str, language: str, level: str):
+    #relays the writer's events, closing this generator (a client disconnect) leaves the writer running
+    events = asyncio.Queue()
+    writer = asyncio.create_task(_write_story(sessions, library, user_id, language, level, events))
+    _story_writers.add(writer)
+    writer.add_done_callback(_story_writers.discard)
+    while True:
+        event = await events.get()
+        if event is None:
+            return
+        yield event
+
+async def evaluate_user_narration(original_text: str, user_narration: str, language: str) -> dict:
+    #exact matches and clear misses are scored locally, only the ambiguous middle goes to gemini
+    with span("narration_local_score"):
+        local_feedback = local_narration_feedback(original_text, user_narration)
+    if local_feedback is not None:
+        return NarrationFeedback.model_validate(local_feedback).model_dump()
+
     prompt = f"""Compare the following original text in {language} with user's narration:
     Original: {original_text}
     User's narration: {user_narration}
@@ -103,72 +216,100 @@ def evaluate_user_narration(original_text: str, user_narration: str, language: s
         "positive_points": ["point1", "point2", "point3"]
     }}"""
     
-    response = model.generate_content(prompt)
-    cleaned_text = response.text.strip()
-    cleaned_text = cleaned_text.replace('```json\n', '').replace('\n```', '')
-    cleaned_text = ''.join(line.strip() for line in cleaned_text.splitlines())
-    
-    return json.loads(cleaned_text)
+    return await generate_structured(prompt, NarrationFeedback)
 
-async def save_part_narration(user_id: str, transcription: str) -> dict:
-    active_story = storydb.active_stories.find_one({"user_id": user_id})
-    
-    if not active_story:
-        raise ValueError("No active story found")
-    
-    current_part = active_story["current_part"]
-    
-    # Handle the case when all parts are completed
-    if current_part > 5:
-        final_feedback = generate_final_feedback(active_story)
-        storydb.active_stories.delete_many({"user_id": user_id})
-        return {
-            "status": "completed",
-            "final_feedback": final_feedback
-        }
+async def save_part_narration(sessions, jobs, user_id: str, transcription: str) -> dict:
+    #the story is read from the session cache, a stale copy shows up as a failed compare-and-set
+    feedback = None
+    feedback_for = None
+    for attempt in range(2):
+        with span("story_session_get"):
+            active_story = await sessions.get(user_id, refresh=attempt > 0)
+        
+        if not active_story:
+            #a retried last narration finds its story already archived and gets the same job back
+            with span("feedback_job_lookup"):
+                job_id = await jobs.find_completed(user_id, transcription)
+            if job_id is None:
+                raise ValueError("No active story found")
+            return {
+                "status": "completed",
+                "job_id": job_id
+            }
+        
+        current_part = active_story["current_part"]
+        
+        # Handle the case when all parts are completed
+        if current_part > 5:
+            sessions.forget(user_id)
+            with span("feedback_job_submit"):
+                job_id = await jobs.submit(active_story)
+            return {
+                "status": "completed",
+                "job_id": job_id
+            }
 
-    original_part = active_story["parts"][current_part - 1]
-    
-    feedback = evaluate_user_narration(
-        original_part["content"],
-        transcription,
-        active_story["language"]
-    )
-    
-    narration_data = {
-        "transcription": transcription,
-        "recorded_at": datetime.utcnow(),
-        "feedback": feedback
-    }
-    
-    next_part = current_part + 1
-    update_data = {
-        "$set": {
-            f"parts.{current_part - 1}.user_narration": narration_data,
-            "current_part": next_part
+        #a streamed story may not have its next part yet, the narration is refused before it is evaluated
+        #so the client can send it again unchanged once the part is there
+        if len(active_story["parts"]) < min(current_part + 1, 5):
+            if attempt == 0:
+                continue
+            raise StoryPartPending("The next part of the story is still being written, try again shortly")
+
+        original_part = active_story["parts"][current_part - 1]
+        
+        #a retry reuses the feedback only when it was computed against the very same text,
+        #the reload may have brought a different story that another worker started meanwhile
+        if feedback_for != (current_part, original_part["content"]):
+            with span("narration_evaluate"):
+                feedback = await evaluate_user_narration(
+                    original_part["content"],
+                    transcription,
+                    active_story["language"]
+                )
+            feedback_for = (current_part, original_part["content"])
+        
+        narration_data = {
+            "transcription": transcription,
+            "recorded_at": datetime.utcnow(),
+            "feedback": feedback
         }
-    }
-    
-    storydb.active_stories.update_one({"user_id": user_id}, update_data)
+        
+        next_part = current_part + 1
+        update_data = {
+            "$set": {
+                f"parts.{current_part - 1}.user_narration": narration_data,
+                "current_part": next_part
+            }
+        }
+        
+        with span("story_session_update"):
+            updated_story = await sessions.update(active_story, update_data)
+        if updated_story is not None:
+            break
+    else:
+        raise ValueError("Story changed while saving the narration")
     
-    # If we've just completed part 5, return completed status
+    # If we've just completed part 5, hand the final feedback to a background job
     if next_part > 5:
-        final_feedback = generate_final_feedback(active_story)
-        storydb.active_stories.delete_many({"user_id": user_id})
+        sessions.forget(user_id)
+        with span("feedback_job_submit"):
+            job_id = await jobs.submit(updated_story)
         return {
             "status": "completed",
-            "final_feedback": final_feedback
+            "job_id": job_id,
+            "current_feedback": feedback
         }
     
     # Return the next part if story is still in progress
     return {
         "status": "in_progress",
-        "next_part": active_story["parts"][next_part - 1],
+        "next_part": updated_story["parts"][next_part - 1],
         "current_feedback": feedback
     }
 
 
-def generate_final_feedback(story: dict) -> dict:
+async def generate_final_feedback(story: dict) -> dict:
     all_parts = [part for part in story["parts"] if part.get("user_narration")]
     prompt = f"""Analyze overall language learning performance across these 5 story parts:
     Original story: {[part["content"] for part in story["parts"]]}
@@ -182,10 +323,4 @@ def generate_final_feedback(story: dict) -> dict:
         "learning_recommendations": ["recommendation1", "recommendation2"]
     }}"""
     
-    response = model.generate_content(prompt)
-    print(response.text)
-    cleaned_text = response.text.strip()
-    cleaned_text = cleaned_text.replace('```\n', '').replace('\n```', '')
-    cleaned_text = ''.join(line.strip() for line in cleaned_text.splitlines())
-    
-    return json.loads(cleaned_text)
+    return await generate_structured(prompt, FinalFeedback)
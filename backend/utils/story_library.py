@@ -0,0 +1,151 @@
+import asyncio
+from datetime import datetime
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from config import settings
+from database import mongo
+from utils.narration_scorer import normalize_text
+from utils.llm_scheduler import set_llm_context, PREFETCH
+from utils.story_helper import generate_stories
+
+#generated stories are kept per (language, level) and handed to every learner who hasn't read them yet
+STORY_LIBRARY_RETRY_DELAY = 5
+
+
+def title_key(title: str) -> str:
+    return normalize_text(title)
+
+
+class StoryLibrary:
+    def __init__(self, mongo, generator, low_water: int, batch: int, max_size: int):
+        self.mongo = mongo
+        self.generator = generator
+        self.low_water = low_water
+        self.batch = batch
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+        self._grow_queue = asyncio.Queue()
+        self._queued = set()
+        self._worker = None
+
+    @property
+    def stories(self):
+        return self.mongo.story_db.story_library
+
+    @property
+    def seen(self):
+        return self.mongo.story_db.story_seen
+
+    async def add(self, language: str, level: str, story: dict) -> dict:
+        #returns the stored story, None when a story with the same title is already in the library
+        fields = {
+            "title": story["title"],
+            "title_english": story["title_english"],
+            "parts": story["parts"],
+            "served": 0,
+            "created_at": datetime.utcnow(),
+        }
+        key = {"language": language, "level": level, "title_key": title_key(story["title"])}
+        try:
+            result = await self.stories.update_one(key, {"$setOnInsert": fields}, upsert=True)
+        except DuplicateKeyError:
+            result = None
+        if result is None or result.upserted_id is None:
+            self.duplicates += 1
+            return None
+        return {"_id": result.upserted_id, **key, **fields}
+
+    async def mark_seen(self, user_id, language: str, level: str, story_id):
+        try:
+            await self.seen.insert_one({
+                "user_id": user_id,
+                "story_id": story_id,
+                "language": language,
+                "level": level,
+                "seen_at": datetime.utcnow(),
+            })
+        except DuplicateKeyError:
+            pass
+
+    async def _unseen_filter(self, user_id, language: str, level: str) -> dict:
+        seen_ids = [doc["story_id"] async for doc in self.seen.find(
+            {"user_id": user_id, "language": language, "level": level}, {"story_id": 1}
+        )]
+        return {"language": language, "level": level, "_id": {"$nin": seen_ids}}
+
+    async def take(self, user_id, language: str, level: str) -> dict:
+        #the least served story this user hasn't read, None when they have read them all
+        unseen = await self._unseen_filter(user_id, language, level)
+        story = await self.stories.find_one_and_update(
+            unseen,
+            {"$inc": {"served": 1}},
+            sort=[("served", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        remaining = await self.stories.count_documents(unseen, limit=self.low_water + 1)
+        if remaining <= self.low_water:
+            self._schedule_growth((language, level))
+        if story is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        await self.mark_seen(user_id, language, level, story["_id"])
+        return story
+
+    async def generate(self, user_id, language: str, level: str) -> dict:
+        #library ran dry for this user, generate inline and keep the story for everyone else
+        story = await self.generator(language, level)
+        stored = await self.add(language, level, story)
+        if stored is not None:
+            await self.mark_seen(user_id, language, level, stored["_id"])
+        return stored or story
+
+    def _schedule_growth(self, key: tuple):
+        if key not in self._queued:
+            self._queued.add(key)
+            self._grow_queue.put_nowait(key)
+
+    async def _grow(self, key: tuple):
+        language, level = key
+        if await self.stories.count_documents({"language": language, "level": level}) >= self.max_size:
+            return
+        for _ in range(self.batch):
+            await self.add(language, level, await self.generator(language, level))
+
+    async def _run(self):
+        set_llm_context(PREFETCH)
+        while True:
+            key = await self._grow_queue.get()
+            try:
+                await self._grow(key)
+            except Exception as e:
+                print(f"Error growing story library {key}: {e}")
+                await asyncio.sleep(STORY_LIBRARY_RETRY_DELAY)
+            finally:
+                self._queued.discard(key)
+
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "duplicates": self.duplicates, "growing": len(self._queued)}
+
+
+story_library = StoryLibrary(
+    mongo,
+    generate_stories,
+    low_water=settings.story_library_low_water,
+    batch=settings.story_library_batch,
+    max_size=settings.story_library_max_size,
+)
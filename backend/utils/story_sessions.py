@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from bson import ObjectId
+from pymongo import ReturnDocument
+from config import settings
+from database import mongo
+
+#active stories kept in memory per user, every write goes through to active_stories
+#version changes on every narration and guards them, session_id names one started story and never changes
+
+
+def new_version() -> ObjectId:
+    #a fresh token per write, unlike a counter it can't repeat once a story is deleted and another one started
+    return ObjectId()
+
+
+class StorySessions:
+    def __init__(self, mongo, maxsize: int):
+        self.mongo = mongo
+        self.maxsize = maxsize
+        self._stories = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+
+    @property
+    def collection(self):
+        return self.mongo.story_db.active_stories
+
+    def _remember(self, story: dict):
+        user_id = story["user_id"]
+        self._stories[user_id] = story
+        self._stories.move_to_end(user_id)
+        while len(self._stories) > self.maxsize:
+            self._stories.popitem(last=False)
+
+    def forget(self, user_id):
+        self._stories.pop(user_id, None)
+
+    async def get(self, user_id, refresh: bool = False) -> dict:
+        if not refresh and user_id in self._stories:
+            self.hits += 1
+            self._stories.move_to_end(user_id)
+            return self._stories[user_id]
+        self.misses += 1
+        story = await self.collection.find_one({"user_id": user_id})
+        if story is None:
+            self.forget(user_id)
+        else:
+            self._remember(story)
+        return story
+
+    async def start(self, story: dict) -> dict:
+        #one atomic upsert replaces whatever story the user had before, keeping its _id,
+        #so the new session_id is what tells the two apart
+        story = {**story, "version": new_version(), "session_id": new_version()}
+        stored = await self.collection.find_one_and_replace(
+            {"user_id": story["user_id"]},
+            story,
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self._remember(stored)
+        return stored
+
+    async def update(self, story: dict, update: dict) -> dict:
+        #compare-and-set on the version we last saw, None when another worker changed the story first
+        update = {**update, "$set": {**update.get("$set", {}), "version": new_version()}}
+        updated = await self.collection.find_one_and_update(
+            #stories from before versioning have no version field, which {"version": None} matches
+            {"user_id": story["user_id"], "version": story.get("version")},
+            update,
+            return_document=ReturnDocument.AFTER,
+        )
+        if updated is None:
+            self.conflicts += 1
+            self.forget(story["user_id"])
+            return None
+        self._remember(updated)
+        return updated
+
+    async def amend(self, story: dict, update: dict) -> dict:
+        #for fields only the story's own writer sets (streamed parts, titles, library id): applied whatever
+        #the version and without bumping it, so narrations saved meanwhile neither block it nor conflict with it
+        #None once the user has started another story
+        updated = await self.collection.find_one_and_update(
+            {"user_id": story["user_id"], "session_id": story.get("session_id")},
+            update,
+            return_document=ReturnDocument.AFTER,
+        )
+        if updated is None:
+            self.forget(story["user_id"])
+            return None
+        self._remember(updated)
+        return updated
+
+    async def remove(self, story: dict):
+        #drops this story even if narrations were saved on it since, never one started after it
+        self.forget(story["user_id"])
+        await self.collection.delete_one({"user_id": story["user_id"], "session_id": story.get("session_id")})
+
+    def stats(self) -> dict:
+        return {"size": len(self._stories), "hits": self.hits, "misses": self.misses, "conflicts": self.conflicts}
+
+
+story_sessions = StorySessions(mongo, settings.story_session_cache_size)
@@ -42,6 +42,21 @@ function StoryMode() {
     }
   };
 
+  const pollFinalFeedback = async (jobId, retries = 30) => {
+    for (let i = 0; i < retries; i++) {
+      const res = await fetch(
+        `${import.meta.env.VITE_API_URL}/storyfeedback/${jobId}`
+      );
+      if (res.ok) {
+        const job = await res.json();
+        if (job.status === "done") return job.final_feedback;
+        if (job.status === "failed") throw new Error("Final feedback failed");
+      }
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
+    throw new Error("Timed out waiting for final feedback");
+  };
+
   const getNewPart = async (transcript) => {
     if (!transcript) {
       alert("Please speak into the microphone and then click next");
@@ -91,8 +106,12 @@ function StoryMode() {
         setCurrentFeedback(data.current_feedback);
       }
 
-      if (data.final_feedback) {
-        setFinalFeedback(data.final_feedback);
+      const finalFeedback =
+        data.final_feedback ||
+        (data.job_id && (await pollFinalFeedback(data.job_id)));
+
+      if (finalFeedback) {
+        setFinalFeedback(finalFeedback);
         incrementScore();
         refreshUserData();
         setImage(null);